@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Customer, Product, Contract, Payment, Guarantor, Account
+from .models import Customer, Product, Contract, Payment, Guarantor, Account, AccountSummary, ShopStats
+from .utils import avatarRenditionUrl
 
 
 @admin.register(Customer)
@@ -29,7 +30,7 @@ class CustomerAdmin(admin.ModelAdmin):
 
     def avatar_preview(self, obj):
         if obj.avatar:
-            return format_html('<img src="{}" width="50" height="50" />', obj.avatar.url)
+            return format_html('<img src="{}" width="50" height="50" />', avatarRenditionUrl(obj.avatar.name, 'thumb'))
         return "No Avatar"
     avatar_preview.short_description = 'Avatar Preview'
 
@@ -45,21 +46,29 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(Contract)
 class ContractAdmin(admin.ModelAdmin):
     list_display = ('account', 'cashValue', 'hireValue', 'downPayment', 'monthlyPayment', 'length', 'cashBalance', 'hireBalance')
-    readonly_fields = ('uid', 'cashBalance', 'hireBalance', 'totalPaid')
+    list_select_related = ('account',)
+    readonly_fields = ('uid', 'cashBalance', 'hireBalance', 'paidTotal', 'totalPaid')
     fieldsets = (
         ('Contract Details', {
             'fields': ('uid', 'cashValue', 'hireValue', 'downPayment', 'monthlyPayment', 'length')
         }),
         ('Balances', {
-            'fields': ('totalPaid', 'cashBalance', 'hireBalance')
+            'fields': ('paidTotal', 'totalPaid', 'cashBalance', 'hireBalance')
         }),
     )
 
 
+class ContractListFilter(admin.RelatedFieldListFilter):
+    """ Contract choices with their accounts in one query (Contract.__str__ shows the account). """
+    def field_choices(self, field, request, model_admin):
+        return [(contract.pk, str(contract)) for contract in Contract.objects.select_related('account')]
+
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('contract', 'date', 'receiptId', 'amount')
-    list_filter = ('date', 'contract')
+    list_filter = ('date', ('contract', ContractListFilter))
+    list_select_related = ('contract__account',)
     search_fields = ('receiptId', 'contract__id')
 
 
@@ -73,6 +82,7 @@ class GuarantorAdmin(admin.ModelAdmin):
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
     list_display = ('accountNumber', 'customer', 'product', 'contract', 'isActive', 'saleDate')
+    list_select_related = ('customer', 'product', 'contract')
     list_filter = ('isActive', 'saleDate')
 
     search_fields = ('accountNumber', 'customer__name')
@@ -89,3 +99,21 @@ class AccountAdmin(admin.ModelAdmin):
             'fields': ('saleDate', 'remarks')
         }),
     )
+
+
+@admin.register(AccountSummary)
+class AccountSummaryAdmin(admin.ModelAdmin):
+    list_display = ('account', 'creator', 'name', 'phone', 'cashBalance', 'isActive')
+    list_select_related = ('account', 'creator')
+    list_filter = ('isActive',)
+    search_fields = ('account__accountNumber', 'name', 'phone')
+    readonly_fields = ('account', 'creator', 'name', 'phone', 'avatar', 'cashBalance', 'isActive')
+
+
+
+@admin.register(ShopStats)
+class ShopStatsAdmin(admin.ModelAdmin):
+    list_display = ('creator', 'outstandingCash', 'activeAccounts', 'closedAccounts', 'collectionsMonth', 'reconciledAt')
+    list_select_related = ('creator',)
+    readonly_fields = ('creator', 'outstandingCash', 'activeAccounts', 'closedAccounts', 'day', 'collectionsToday',
+        'month', 'collectionsMonth', 'newSalesMonth', 'reconciledAt')
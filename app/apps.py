@@ -6,3 +6,6 @@ class AppConfig(AppConfig):
 
     def ready(self):
         import app.signals
+        from django.db.models.signals import post_migrate
+        from .search import createTrigramIndexes
+        post_migrate.connect(createTrigramIndexes, sender=self)
@@ -0,0 +1,88 @@
+from datetime import date
+
+import numpy as np
+
+from .models import Account
+
+
+def loadContracts(creator=None):
+    """ Active accounts with a contract, column by column. """
+    accounts = Account.objects.filter(isActive=True, contract__isnull=False)
+    if creator is not None:
+        accounts = accounts.filter(creator=creator)
+
+    rows = accounts.order_by().values_list(
+        'accountNumber', 'customer__name', 'customer__phone', 'saleDate',
+        'contract__downPayment', 'contract__monthlyPayment', 'contract__length',
+        'contract__hireValue', 'contract__paidTotal',
+    )
+    columns = list(zip(*rows)) or [()] * 9
+    accountNumbers, names, phones, saleDates, downPayment, monthly, length, hireValue, paidTotal = columns
+
+    return {
+        'accountNumber': accountNumbers,
+        'name': names,
+        'phone': phones,
+        'saleDate': np.array(saleDates, dtype='datetime64[D]'),
+        'downPayment': np.array(downPayment, dtype=np.int64),
+        'monthlyPayment': np.array(monthly, dtype=np.int64),
+        'length': np.array(length, dtype=np.int64),
+        'hireValue': np.array(hireValue, dtype=np.int64),
+        'paidTotal': np.array(paidTotal, dtype=np.int64),
+    }
+
+
+def computeArrears(contracts, as_of=None):
+    """
+    Vectorized schedule check over all loaded contracts. The down payment is due on
+    the sale date and one installment on the same day of every following month,
+    up to `length` installments and never more than the hire value.
+
+    Adds expected, paid, arrears and monthsOverdue arrays to `contracts`.
+    """
+    as_of = np.datetime64(as_of or date.today(), 'D')
+    saleDate = contracts['saleDate']
+
+    # Whole months between sale date and as_of, minus one if the day of month isn't reached yet
+    saleMonth = saleDate.astype('datetime64[M]')
+    saleDay = (saleDate - saleMonth.astype('datetime64[D]')).astype(np.int64)
+    asOfMonth = as_of.astype('datetime64[M]')
+    asOfDay = (as_of - asOfMonth.astype('datetime64[D]')).astype(np.int64)
+    months = (asOfMonth - saleMonth).astype(np.int64) - (asOfDay < saleDay)
+
+    installments = np.clip(months, 0, contracts['length'])
+    expected = np.minimum(
+        contracts['downPayment'] + installments * contracts['monthlyPayment'],
+        contracts['hireValue'],
+    )
+    expected = np.where(saleDate > as_of, 0, expected)  # Sales dated in the future owe nothing yet
+
+    paid = contracts['downPayment'] + contracts['paidTotal']
+    arrears = np.maximum(expected - paid, 0)
+
+    monthly = contracts['monthlyPayment']
+    monthsOverdue = np.where(monthly > 0, -(-arrears // np.maximum(monthly, 1)), 0)
+
+    contracts.update(expected=expected, paid=paid, arrears=arrears, monthsOverdue=monthsOverdue)
+    return contracts
+
+
+def overdueAccounts(creator=None, as_of=None, min_months=1, limit=None):
+    """ Accounts at least `min_months` installments behind, largest arrears first. """
+    contracts = computeArrears(loadContracts(creator), as_of)
+
+    selected = np.flatnonzero((contracts['arrears'] > 0) & (contracts['monthsOverdue'] >= min_months))
+    selected = selected[np.argsort(-contracts['arrears'][selected], kind='stable')]
+    if limit is not None:
+        selected = selected[:limit]
+
+    return [{
+        'accountNumber': contracts['accountNumber'][i],
+        'name': contracts['name'][i],
+        'phone': contracts['phone'][i],
+        'saleDate': str(contracts['saleDate'][i]),
+        'expected': int(contracts['expected'][i]),
+        'paid': int(contracts['paid'][i]),
+        'arrears': int(contracts['arrears'][i]),
+        'monthsOverdue': int(contracts['monthsOverdue'][i]),
+    } for i in selected]
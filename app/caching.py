@@ -0,0 +1,204 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from . import metrics
+
+
+PRECREATION_CACHE_TIMEOUT = 24 * 60 * 60
+PRODUCTS_VERSION_KEY = 'data:v:products'
+
+
+def dataCache():
+    """ Cache backend for versioned payloads, settings.DATA_CACHE_ALIAS of CACHES. """
+    return caches[getattr(settings, 'DATA_CACHE_ALIAS', 'default')]
+
+
+def _freshVersion():
+    # Used when a counter is missing (first use or evicted): larger than any earlier value
+    return int(time.time() * 1000)
+
+
+def _version(key):
+    return _versions([key])[key]
+
+
+def _versions(keys):
+    cache = dataCache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = _freshVersion()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return versions
+
+
+def _bump(key):
+    # Versions follow the clock so bumps racing in different workers rarely collide
+    cache = dataCache()
+    version = max(cache.get(key, 0) + 1, _freshVersion())
+    cache.set(key, version, None)
+    return version
+
+
+# ++++++++++++++++ CUSTOMER / GUARANTOR / PRODUCT VERSIONS +++++++++++++++++++
+
+def userDataVersion(user_id):
+    """ (version, resetVersion) of a user's customers and guarantors. """
+    version = _version(f'data:v:{user_id}')
+    reset = dataCache().get(f'data:reset:{user_id}')
+    if reset is None:  # Unknown history: clients older than now need the full payload
+        reset = version
+        dataCache().set(f'data:reset:{user_id}', reset, None)
+    return version, reset
+
+
+def bumpUserDataVersion(user_id, deleted=False):
+    """
+    Called after a user's customers or guarantors changed. Clients holding an older
+    version can catch up with the rows changed since (by updatedAt), unless rows were
+    `deleted`, which forces them to reload everything.
+    """
+    version = _bump(f'data:v:{user_id}')
+    if deleted:
+        dataCache().set(f'data:reset:{user_id}', version, None)
+    return version
+
+
+def versionTime(version):
+    # Versions are millisecond timestamps (see _freshVersion and _bump)
+    return datetime.fromtimestamp(version / 1000, timezone.utc)
+
+
+def productVersion():
+    return _version(PRODUCTS_VERSION_KEY)
+
+
+def bumpProductVersion():
+    return _bump(PRODUCTS_VERSION_KEY)
+
+
+def preCreationToken(user_id, version, product_version):
+    return f'{user_id}.{version}.{product_version}'
+
+
+def parsePreCreationToken(token):
+    """ (user id, version, product version) of a client's token, or None. """
+    try:
+        user_id, version, product_version = (int(part) for part in token.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    return user_id, version, product_version
+
+
+def cachedPreCreationData(user_id, version, product_version, build):
+    """ Full creation form payload of a user for these versions, built by `build()` on a miss. """
+    key = f'precreation:{preCreationToken(user_id, version, product_version)}'
+    cache = dataCache()
+    data = cache.get(key)
+    metrics.cacheLookup('precreation', data is not None)
+    if data is None:
+        data = build()
+        cache.set(key, data, PRECREATION_CACHE_TIMEOUT)
+    return data
+
+
+# ++++++++++++++++++++++++ ACCOUNT VERSIONS / CONDITIONAL GET +++++++++++++++++++++++++
+
+def accountsVersionKey(user_id):
+    """ Bumped on any write to a user's accounts, contracts, payments or customers. """
+    return f'data:accounts:{user_id}'
+
+
+def accountVersionKey(pk):
+    """ Bumped on writes to one account or the rows shown on its page. """
+    return f'data:account:{pk}'
+
+
+def accountsEpochKey(user_id):
+    """ Bumped by bulk operations instead of every touched account's own version. """
+    return f'data:accounts-epoch:{user_id}'
+
+
+def bumpAccountVersions(accounts):
+    """ Bump the versions of `accounts`, (accountNumber, creator id) pairs, and of their owners. """
+    keys = set()
+    for pk, creator_id in accounts:
+        keys.add(accountVersionKey(pk))
+        keys.add(accountsVersionKey(creator_id))
+    for key in keys:
+        _bump(key)
+
+
+def bumpAllAccountVersions(user_ids):
+    """ Invalidate every account of these users at once, after a bulk import or recalculation. """
+    for user_id in set(user_ids):
+        _bump(accountsVersionKey(user_id))
+        _bump(accountsEpochKey(user_id))
+
+
+def clientState(request):
+    """
+    What a page depends on besides the data: its {% csrf_token %} (the CSRF cookie, a
+    new one after every login, and the session) and whether messages are waiting to be shown.
+    """
+    session = getattr(request, 'session', None)
+    pendingMessages = bool(request.COOKIES.get('messages')) or (session is not None and '_messages' in session)
+    return [
+        session.session_key if session is not None else None,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        pendingMessages,
+    ]
+
+
+def conditionalOn(versionKeys):
+    """
+    Answer conditional GETs from data versions. `versionKeys(request, *args, **kwargs)`
+    returns the cache keys of the versions the response depends on; when the client's
+    ETag still matches, the view isn't run and a 304 is returned. There is no
+    Last-Modified: it has one second resolution and can't include the client state.
+    """
+    def versionsOf(request, *args, **kwargs):
+        if not hasattr(request, '_dataVersions'):
+            keys = versionKeys(request, *args, **kwargs)
+            request._dataVersions = [version for _, version in sorted(_versions(keys).items())]
+        return request._dataVersions
+
+    def etag(request, *args, **kwargs):
+        versions = versionsOf(request, *args, **kwargs)
+        parts = [request.user.pk, request.get_full_path(), *clientState(request), *versions]
+        return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+    def finish(response):
+        metrics.cacheLookup('conditional-get', response.status_code == 304)
+        if response.has_header('ETag'):
+            # Let the browser keep the page, but always revalidate it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def decorator(view):
+        conditional = condition(etag_func=etag)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def asyncWrapper(request, *args, **kwargs):
+                # condition() calls etag() in the event loop: load the user and versions beforehand
+                request.user = await request.auser()
+                await sync_to_async(versionsOf)(request, *args, **kwargs)
+                return finish(await conditional(request, *args, **kwargs))
+            return asyncWrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return finish(conditional(request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,99 @@
+import csv
+from datetime import date
+
+from django.db.models import Exists, OuterRef, Prefetch
+
+from .models import Account, Payment
+
+
+LEDGER_HEADER = [
+    'accountNumber', 'saleDate', 'isActive', 'customerUid', 'customerName', 'customerPhone', 'customerAddress',
+    'productModel', 'productCategory', 'cashValue', 'hireValue', 'downPayment', 'monthlyPayment', 'length',
+    'paidTotal', 'cashBalance', 'hireBalance', 'paymentDate', 'receiptId', 'paymentAmount',
+]
+
+
+def parseDate(value):
+    """ None for an empty value, otherwise an ISO date (raises ValueError). """
+    return date.fromisoformat(value) if value else None
+
+
+def ledgerRows(creator=None, date_from=None, date_to=None, chunk_size=2000):
+    """
+    Yield the ledger as lists matching LEDGER_HEADER, one row per payment (accounts
+    without payments get one row with empty payment columns).
+
+    Accounts are read with iterator(chunk_size) and their payments are prefetched one
+    chunk at a time, so memory stays flat however large the ledger is. With a date
+    range only payments on those dates, and only accounts having such payments, are
+    exported.
+    """
+    payments = Payment.objects.order_by('date', 'pk').only('contract_id', 'date', 'receiptId', 'amount')
+    if date_from:
+        payments = payments.filter(date__gte=date_from)
+    if date_to:
+        payments = payments.filter(date__lte=date_to)
+
+    accounts = (Account.objects
+        .select_related('customer', 'product', 'contract')
+        .only('accountNumber', 'saleDate', 'isActive',
+            'customer__uid', 'customer__name', 'customer__phone', 'customer__address',
+            'product__model', 'product__category',
+            'contract__cashValue', 'contract__hireValue', 'contract__downPayment', 'contract__monthlyPayment',
+            'contract__length', 'contract__paidTotal', 'contract__cashBalance', 'contract__hireBalance')
+        .prefetch_related(Prefetch('contract__payments', queryset=payments))
+        .order_by('accountNumber'))
+
+    if creator is not None:
+        accounts = accounts.filter(creator=creator)
+    if date_from or date_to:
+        accounts = accounts.filter(Exists(payments.filter(contract=OuterRef('contract'))))
+
+    for account in accounts.iterator(chunk_size=chunk_size):
+        customer, product, contract = account.customer, account.product, account.contract
+        base = [
+            account.accountNumber, account.saleDate.isoformat(), account.isActive,
+            customer.uid, customer.name, customer.phone, customer.address,
+            product.model if product else '', product.category if product else '',
+        ]
+        if contract:
+            base += [contract.cashValue, contract.hireValue, contract.downPayment, contract.monthlyPayment,
+                contract.length, contract.paidTotal, contract.cashBalance, contract.hireBalance]
+            accountPayments = contract.payments.all()
+        else:
+            base += [''] * 8
+            accountPayments = []
+
+        if not accountPayments:
+            yield base + ['', '', '']
+        for payment in accountPayments:
+            yield base + [payment.date.isoformat(), payment.receiptId, payment.amount]
+
+
+class Echo:
+    """ File-like object that hands back what is written, for streaming csv.writer output. """
+
+    def write(self, value):
+        return value
+
+
+def csvLines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(LEDGER_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def writeXlsx(rows, path):
+    """ Write the ledger to an .xlsx file in openpyxl's constant-memory write-only mode. """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportError("XLSX export requires the openpyxl package.")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Ledger')
+    sheet.append(LEDGER_HEADER)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
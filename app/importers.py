@@ -0,0 +1,500 @@
+import csv
+import io
+import json
+import time
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Account, AccountSummary, Contract, Customer, Guarantor, Payment, Product, ShopStats, UidCounter
+from .utils import CUSTOMER_UID_FLOOR, GUARANTOR_UID_FLOOR, defaultAvatar, normalizePhone
+from .caching import bumpAccountVersions, bumpAllAccountVersions, bumpProductVersion, bumpUserDataVersion
+from .sync import forgetDeleted
+from . import metrics
+
+
+MAX_REPORTED_ERRORS = 1000
+
+# Payments accepted by one postPayments() call
+MAX_POSTED_PAYMENTS = 500
+
+
+def readRows(stream, fmt):
+    """
+    Yield (line number, row dict) from a binary CSV or JSONL stream, one line at a time.
+    Lines that can't be parsed are yielded as (line number, None).
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+
+    else:
+        raise ValueError(f"Unsupported file format: {fmt}")
+
+
+def detectFormat(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ImportReport:
+    """ Counts and per-row errors of an import run. """
+
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.errorCount = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    def error(self, line, message):
+        self.errorCount += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0
+
+    def asDict(self):
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'errorCount': self.errorCount,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+        }
+
+
+
+# ++++++++++++++++ PAYMENTS +++++++++++++++++++
+
+def parsePayment(row):
+    """ Return (accountNumber, receiptId, date, amount) or raise ValueError with a readable message. """
+    if row is None:
+        raise ValueError("Unreadable row.")
+
+    for field in ('account', 'receiptId', 'date', 'amount'):
+        if not str(row.get(field) or '').strip():
+            raise ValueError(f'"{field}" is required.')
+
+    try:
+        amount = int(row['amount'])
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid amount "{row["amount"]}".')
+    if amount <= 0:
+        raise ValueError("Amount must be positive.")
+
+    try:
+        paymentDate = date.fromisoformat(str(row['date']).strip())
+    except ValueError:
+        raise ValueError(f'Invalid date "{row["date"]}", expected YYYY-MM-DD.')
+
+    return str(row['account']).strip().upper(), str(row['receiptId']).strip(), paymentDate, amount
+
+
+def importPayments(rows, creator=None, batch_size=1000, report=None):
+    """
+    Import (line number, row) pairs of account/receiptId/date/amount.
+
+    Every batch is one transaction: its rows are validated against one query of the
+    accounts with their contracts locked (as postPayments does, so concurrent payments
+    can't over-pay them) and one receipt query, inserted with bulk_create (no per-row
+    signals), and the affected contracts are recalculated before the locks are released.
+    Invalid rows are reported and skipped. When `creator` is given only that user's
+    accounts can receive payments.
+    """
+    report = report or ImportReport()
+    seenReceipts = set()
+
+    for batch in batched(rows, batch_size):
+        parsed = []
+        for line, row in batch:
+            report.processed += 1
+            try:
+                parsed.append((line, *parsePayment(row)))
+            except ValueError as e:
+                report.error(line, str(e))
+
+        with transaction.atomic():
+            # Balances are checked against the locked contracts and rebuilt below
+            accounts = Account.objects.filter(contract__isnull=False).select_related('contract').select_for_update(of=('contract',))
+            if creator is not None:
+                accounts = accounts.filter(creator=creator)
+            contracts = {pk: account.contract for pk, account in accounts.in_bulk({p[1] for p in parsed}).items()}
+            hireBalances = {contract.pk: contract.hireBalance for contract in contracts.values()}
+
+            receipts = {p[2] for p in parsed}
+            existingReceipts = set(Payment.objects.filter(receiptId__in=receipts).values_list('receiptId', flat=True))
+
+            payments = []
+            for line, accountNumber, receiptId, paymentDate, amount in parsed:
+                contract = contracts.get(accountNumber)
+                if contract is None:
+                    report.error(line, f'Account "{accountNumber}" does not exist or has no contract.')
+                elif receiptId in existingReceipts or receiptId in seenReceipts:
+                    report.error(line, f'"{receiptId}" this receipt ID already exists.')
+                elif amount > hireBalances[contract.pk]:
+                    report.error(line, f'Payment amount exceeds hire balance of "{accountNumber}".')
+                else:
+                    seenReceipts.add(receiptId)
+                    hireBalances[contract.pk] -= amount
+                    payments.append((line, Payment(contract_id=contract.pk, receiptId=receiptId, date=paymentDate, amount=amount)))
+
+            created = _insertPayments(payments, report)
+            if created:
+                Contract.recalculateMany({payment.contract_id for _, payment in payments})
+        report.created += created
+        transaction.on_commit(lambda created=created: metrics.inc('cms_payments_posted_total', created, source='import'))
+
+    return report
+
+
+def _insertPayments(payments, report):
+    """ bulk_create a batch; if a receipt was taken meanwhile, retry row by row to find it. """
+    try:
+        with transaction.atomic():
+            Payment.objects.bulk_create([payment for _, payment in payments])
+        return len(payments)
+    except IntegrityError:
+        pass
+
+    created = 0
+    for line, payment in payments:
+        try:
+            with transaction.atomic():
+                Payment.objects.bulk_create([payment])
+            created += 1
+        except IntegrityError:
+            report.error(line, f'"{payment.receiptId}" this receipt ID already exists.')
+    return created
+
+
+def postPayments(items, creator):
+    """
+    Post a collection route: payments (account/receiptId/date/amount dicts) to many
+    accounts of `creator` in one transaction and a fixed number of queries. Returns a
+    result per item, in order: 'created' with the new cash balance, 'duplicate' when
+    the same payment was already posted (a retried upload), or 'error' with a message.
+    Raises IntegrityError if one of the receipts was posted meanwhile by another request.
+    """
+    results = []
+    parsed = []
+    for index, item in enumerate(items):
+        receiptId = item.get('receiptId') if isinstance(item, dict) else None
+        results.append({'index': index, 'receiptId': receiptId})
+        try:
+            parsed.append((index, *parsePayment(item if isinstance(item, dict) else None)))
+        except ValueError as e:
+            results[index].update(status='error', message=str(e))
+
+    with transaction.atomic():
+        # Balances are checked against the locked contracts and written back below
+        accounts = (Account.objects.filter(creator=creator, contract__isnull=False)
+            .select_related('contract').select_for_update(of=('contract',))
+            .in_bulk({p[1] for p in parsed}))
+        posted = {receiptId: (contractId, paymentDate, amount) for receiptId, contractId, paymentDate, amount in
+            Payment.objects.filter(receiptId__in={p[2] for p in parsed}).order_by().values_list('receiptId', 'contract_id', 'date', 'amount')}
+
+        payments = []
+        touched = {}  # accountNumber -> Account
+        for index, accountNumber, receiptId, paymentDate, amount in parsed:
+            account = accounts.get(accountNumber)
+            contract = account.contract if account else None
+            if contract is None:
+                results[index].update(status='error', message=f'Account "{accountNumber}" does not exist or has no contract.')
+            elif receiptId in posted:
+                if posted[receiptId] == (contract.pk, paymentDate, amount):
+                    results[index].update(status='duplicate', cashBalance=contract.cashBalance)
+                else:
+                    results[index].update(status='error', message=f'"{receiptId}" this receipt ID already exists.')
+            elif amount > contract.hireBalance:
+                results[index].update(status='error', message=f'Payment amount exceeds hire balance of "{accountNumber}".')
+            else:
+                posted[receiptId] = (contract.pk, paymentDate, amount)
+                contract.paidTotal += amount
+                contract.cashBalance -= amount
+                contract.hireBalance -= amount
+                touched[accountNumber] = account
+                payments.append(Payment(contract=contract, receiptId=receiptId, date=paymentDate, amount=amount))
+                results[index].update(status='created', cashBalance=contract.cashBalance)
+
+        if payments:
+            _applyPostedPayments(creator, payments, list(touched.values()))
+    return results
+
+
+def _applyPostedPayments(creator, payments, accounts):
+    # What the payment signals do one by one, once for the whole batch
+    Payment.objects.bulk_create(payments)
+    now = timezone.now()
+    for account in accounts:
+        account.contract.updatedAt = now
+    Contract.objects.bulk_update([account.contract for account in accounts], ['paidTotal', 'cashBalance', 'hireBalance', 'updatedAt'])
+    AccountSummary.objects.bulk_update(
+        [AccountSummary(pk=account.pk, cashBalance=account.contract.cashBalance) for account in accounts], ['cashBalance'])
+
+    # Dashboard totals: only today's and this month's collections are kept
+    today, month = ShopStats.period()
+    active = {account.contract_id for account in accounts if account.isActive}
+    outstanding = -sum(payment.amount for payment in payments if payment.contract_id in active)
+    otherDays = [payment for payment in payments if payment.date != today and payment.date.replace(day=1) == month]
+    if otherDays:  # Before the call below, that may build the row with reconcile() which counts them already
+        ShopStats.adjust(creator_id=creator.pk, collected=sum(payment.amount for payment in otherDays),
+            collectedOn=otherDays[0].date, create=False)
+    ShopStats.adjust(creator_id=creator.pk, outstanding=outstanding,
+        collected=sum(payment.amount for payment in payments if payment.date == today), collectedOn=today)
+
+    touched = [(account.pk, creator.pk) for account in accounts]
+    transaction.on_commit(lambda: bumpAccountVersions(touched))
+    transaction.on_commit(lambda: metrics.inc('cms_payments_posted_total', len(payments), source='batch'))
+
+
+
+# ++++++++++++++++ LEDGER ONBOARDING +++++++++++++++++++
+
+LEDGER_INT_FIELDS = ('cashValue', 'hireValue', 'downPayment', 'monthlyPayment', 'length')
+LEDGER_REQUIRED_FIELDS = ('accountNumber', 'saleDate', 'customerName', 'customerPhone', 'customerAddress',
+    'productModel') + LEDGER_INT_FIELDS
+
+
+def _text(row, field):
+    value = row.get(field)
+    return str(value).strip() if value is not None else ''
+
+
+def _phone(row, field):
+    phone = normalizePhone(_text(row, field))
+    if not phone:
+        raise ValueError(f'Invalid phone number in "{field}": "{_text(row, field)}".')
+    return phone
+
+
+def parseLedgerRow(row):
+    """ Validate a flat ledger row and return it cleaned, or raise ValueError. """
+    if row is None:
+        raise ValueError("Unreadable row.")
+
+    for field in LEDGER_REQUIRED_FIELDS:
+        if not _text(row, field):
+            raise ValueError(f'"{field}" is required.')
+
+    accountNumber = Account.validate_and_format(_text(row, 'accountNumber'))
+    if not accountNumber:
+        raise ValueError(f'Invalid account number "{_text(row, "accountNumber")}".')
+
+    figures = {}
+    for field in LEDGER_INT_FIELDS:
+        try:
+            figures[field] = int(_text(row, field))
+        except ValueError:
+            raise ValueError(f'Invalid {field} "{_text(row, field)}".')
+        if figures[field] < 0:
+            raise ValueError(f'"{field}" cannot be negative.')
+    if figures['downPayment'] > figures['hireValue']:
+        raise ValueError("Down payment cannot exceed the hire value.")
+
+    try:
+        saleDate = date.fromisoformat(_text(row, 'saleDate'))
+    except ValueError:
+        raise ValueError(f'Invalid sale date "{_text(row, "saleDate")}", expected YYYY-MM-DD.')
+
+    guarantors = []
+    for prefix in ('guarantor1', 'guarantor2'):
+        name, phone = _text(row, f'{prefix}Name'), _text(row, f'{prefix}Phone')
+        if name and phone:
+            guarantors.append({
+                'name': name, 'phone': phone, 'phoneE164': _phone(row, f'{prefix}Phone'),
+                'address': _text(row, f'{prefix}Address') or None,
+                'occupation': _text(row, f'{prefix}Occupation') or None,
+            })
+        elif name or phone:
+            raise ValueError(f'"{prefix}Name" and "{prefix}Phone" must be given together.')
+
+    return {
+        'accountNumber': accountNumber,
+        'saleDate': saleDate,
+        'isActive': _text(row, 'isActive').lower() not in ('0', 'false', 'no', 'closed'),
+        'remarks': _text(row, 'remarks') or None,
+        'customer': {
+            'name': _text(row, 'customerName'),
+            'phone': _text(row, 'customerPhone'),
+            'phoneE164': _phone(row, 'customerPhone'),
+            'address': _text(row, 'customerAddress'),
+            'occupation': _text(row, 'customerOccupation') or None,
+            'guardianType': _text(row, 'guardianType') or None,
+            'guardianName': _text(row, 'guardianName') or None,
+        },
+        'guarantors': guarantors,
+        'product': {
+            'model': _text(row, 'productModel').upper(),
+            'category': _text(row, 'productCategory') or 'Others',
+        },
+        **figures,
+    }
+
+
+class LedgerImporter:
+    """
+    Imports flat ledger rows (one account per row with its customer, up to two
+    guarantors, product and contract figures) for one shop.
+
+    Customers and guarantors of the shop are resolved by phone from in-memory maps
+    loaded with one query each; everything new in a batch is written with one
+    bulk_create per table, and uids come from a single reserved block per batch.
+    The block is reserved in its own short transaction before the batch's, which
+    would otherwise keep the UidCounter rows locked for every other writer until
+    the whole batch commits; uids of a failed batch are skipped.
+    """
+
+    def __init__(self, creator, batch_size=1000, progress=None):
+        self.creator = creator
+        self.batch_size = batch_size
+        self.progress = progress  # Called with the report after every batch
+        self.report = ImportReport()
+
+        # Keyed by normalized phone; rows not backfilled yet (see normalize_phones) are normalized here
+        self.customers = {c.phoneE164 or normalizePhone(c.phone): c for c in
+            Customer.objects.filter(creator=creator).only('uid', 'name', 'phone', 'phoneE164', 'avatar').iterator()}
+        self.guarantors = {phoneE164 or normalizePhone(phone): uid for uid, phone, phoneE164 in
+            Guarantor.objects.filter(creator=creator).values_list('uid', 'phone', 'phoneE164').iterator()}
+        self.products = set(Product.objects.values_list('model', flat=True))
+        self.seenAccounts = set()
+
+    def run(self, rows):
+        for batch in batched(rows, self.batch_size):
+            parsed = []
+            for line, row in batch:
+                self.report.processed += 1
+                try:
+                    parsed.append((line, parseLedgerRow(row)))
+                except ValueError as e:
+                    self.report.error(line, str(e))
+
+            records = self._newAccounts(parsed)
+            if records:
+                customers, guarantors = self._newCustomers(records), self._newGuarantors(records)
+                with transaction.atomic():
+                    self._reserveUids(Customer, CUSTOMER_UID_FLOOR, customers.values())
+                    self._reserveUids(Guarantor, GUARANTOR_UID_FLOOR, guarantors.values())
+                with transaction.atomic():
+                    self.report.created += self._importBatch(records, customers, guarantors)
+
+            if self.progress:
+                self.progress(self.report)
+
+        ShopStats.reconcile([self.creator.pk])  # bulk_create skipped the signals
+        bumpUserDataVersion(self.creator.pk)
+        bumpAllAccountVersions([self.creator.pk])
+        return self.report
+
+    def _newAccounts(self, parsed):
+        accountNumbers = [record['accountNumber'] for _, record in parsed]
+        existing = set(Account.objects.filter(pk__in=accountNumbers).values_list('pk', flat=True))
+
+        records = []
+        for line, record in parsed:
+            if record['accountNumber'] in existing or record['accountNumber'] in self.seenAccounts:
+                self.report.error(line, f'An account already exists with this "{record["accountNumber"]}" account number.')
+                continue
+            self.seenAccounts.add(record['accountNumber'])
+            records.append(record)
+        return records
+
+    def _importBatch(self, records, customers, guarantors):
+        Customer.objects.bulk_create(customers.values())
+        self.customers.update(customers)
+        Guarantor.objects.bulk_create(guarantors.values())
+        self.guarantors.update({phone: guarantor.uid for phone, guarantor in guarantors.items()})
+        self._createProducts(records)
+
+        contracts = Contract.objects.bulk_create([Contract(
+            uid=record['accountNumber'],
+            cashValue=record['cashValue'],
+            hireValue=record['hireValue'],
+            downPayment=record['downPayment'],
+            monthlyPayment=record['monthlyPayment'],
+            length=record['length'],
+            cashBalance=record['cashValue'] - record['downPayment'],
+            hireBalance=record['hireValue'] - record['downPayment'],
+        ) for record in records])
+
+        accounts = Account.objects.bulk_create([Account(
+            accountNumber=record['accountNumber'],
+            creator=self.creator,
+            customer=self.customers[record['customer']['phoneE164']],
+            product_id=record['product']['model'],
+            contract=contract,
+            saleDate=record['saleDate'],
+            isActive=record['isActive'],
+            remarks=record['remarks'],
+        ) for record, contract in zip(records, contracts)])
+
+        Through = Account.guarantors.through
+        Through.objects.bulk_create([
+            Through(account_id=record['accountNumber'], guarantor_id=uid)
+            for record in records
+            for uid in {self.guarantors[g['phoneE164']] for g in record['guarantors']}
+        ])
+
+        AccountSummary.sync(accounts)
+        forgetDeleted(Account, [account.pk for account in accounts])  # bulk_create skipped the signals
+        return len(accounts)
+
+    def _newCustomers(self, records):
+        new = {}
+        for record in records:
+            data = record['customer']
+            if data['phoneE164'] not in self.customers and data['phoneE164'] not in new:
+                new[data['phoneE164']] = Customer(creator=self.creator, avatar=defaultAvatar, **data)
+        return new
+
+    def _newGuarantors(self, records):
+        new = {}
+        for record in records:
+            for data in record['guarantors']:
+                if data['phoneE164'] not in self.guarantors and data['phoneE164'] not in new:
+                    new[data['phoneE164']] = Guarantor(creator=self.creator, **data)
+        return new
+
+    def _reserveUids(self, model, floor, objects):
+        objects = list(objects)
+        if not objects:
+            return
+        uid = UidCounter.reserve(model, floor, len(objects))
+        for offset, obj in enumerate(objects):
+            obj.uid = uid + offset
+
+    def _createProducts(self, records):
+        new = {}
+        for record in records:
+            if record['product']['model'] not in self.products:
+                new[record['product']['model']] = Product(**record['product'])
+        if new:
+            Product.objects.bulk_create(new.values(), ignore_conflicts=True)
+            self.products.update(new)
+            transaction.on_commit(bumpProductVersion)
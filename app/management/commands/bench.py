@@ -0,0 +1,227 @@
+import json
+import platform
+import resource
+import time
+import tracemalloc
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+
+from app.models import Account, Payment
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of sorted `values`. """
+    index = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every view through the test client against the current database (e.g. filled by "
+        "seed_bench) and print latency percentiles, query counts and peak memory as JSON. "
+        "Writes happen in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='bench-0', help="Shop the requests are made as")
+        parser.add_argument('--iterations', type=int, default=20, help="Measured requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per endpoint first")
+        parser.add_argument('--only', nargs='*', help="Endpoint names to run, default all")
+        parser.add_argument('--admin', help="Superuser to also benchmark the admin changelists as")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if not user:
+            raise CommandError(f"User \"{options['user']}\" does not exist, see seed_bench.")
+        # An open account with room for the benchmarked payments
+        accounts = Account.objects.filter(creator=user).select_related('customer').order_by('pk')
+        account = accounts.filter(isActive=True, contract__hireBalance__gte=1000).first() or accounts.first()
+        if not account:
+            raise CommandError(f"User \"{options['user']}\" has no accounts.")
+
+        try:
+            setup_test_environment()  # Allows the test client's host
+        except RuntimeError:  # Already set up, e.g. when run from a test
+            pass
+        self.client = Client()
+        self.client.force_login(user)
+        self.anonymous = Client()
+        self.user, self.account = user, account
+
+        self.adminClient = None
+        if options['admin']:
+            admin = User.objects.filter(username=options['admin'], is_superuser=True).first()
+            if not admin:
+                raise CommandError(f"Superuser \"{options['admin']}\" does not exist.")
+            self.adminClient = Client()
+            self.adminClient.force_login(admin)
+
+        endpoints = self.endpoints()
+        if options['only']:
+            unknown = set(options['only']) - set(endpoints)
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}. Known: {', '.join(endpoints)}")
+            endpoints = {name: endpoints[name] for name in options['only']}
+
+        results = {}
+        try:
+            with transaction.atomic():
+                for name, request in endpoints.items():
+                    results[name] = self.measure(request, options['iterations'], options['warmup'])
+                    self.stderr.write(f"  {name}: p50 {results[name]['p50_ms']} ms, {results[name]['queries']} queries")
+                raise Rollback
+        except Rollback:
+            pass
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'user': user.username,
+                'accounts': Account.objects.filter(creator=user).count(),
+                'payments': Payment.objects.filter(contract__account__creator=user).count(),
+                'iterations': options['iterations'],
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def measure(self, request, iterations, warmup):
+        prepare = getattr(request, 'prepare', lambda: None)  # Unmeasured setup before every request
+        for _ in range(warmup):
+            prepare()
+            request()
+
+        timings, queries, status = [], [], None
+        for _ in range(iterations):
+            prepare()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                status = request()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+
+        # One more run for memory, tracemalloc slows everything down
+        prepare()
+        tracemalloc.start()
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'status': status,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+            'queries': max(queries),
+            'peak_memory_kb': round(peak / 1024),
+        }
+
+    def get(self, url, client=None, headers=None, **params):
+        def request():
+            response = (client or self.client).get(url, params, headers=headers)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            return response.status_code
+        return request
+
+    def post(self, url, data):
+        # data() gives the JSON body, unique per call where the view creates rows
+        def request():
+            return self.client.post(url, json.dumps(data()), content_type='application/json').status_code
+        return request
+
+    def logout(self):
+        client = Client()
+        def request():
+            return client.get('/user/logout/').status_code
+        request.prepare = lambda: client.force_login(self.user)
+        return request
+
+    def upload(self, url, content):
+        def request():
+            return self.client.post(url, {'file': SimpleUploadedFile('bench.csv', content())}).status_code
+        return request
+
+    def endpoints(self):
+        account, customer = self.account, self.account.customer
+        guarantor = account.guarantors.first()
+        avatar = customer.avatar.name
+        counter = iter(range(1, 10 ** 6))
+
+        metricsToken = {'Authorization': f'Bearer {settings.METRICS_TOKEN}'} if settings.METRICS_TOKEN else None
+
+        endpoints = {
+            'login': self.get('/user/login/', client=self.anonymous),
+            'logout': self.logout(),
+            'signUp': self.get('/user/sign-up/', client=self.anonymous),
+            'home': self.get('/'),
+            'dashboardStats': self.get('/dashboard/stats/'),
+            'accounts': self.get('/accounts/get/', limit=50),
+            'accountsSearch': self.get('/accounts/get/', by='name', q=customer.name.split()[0]),
+            'searchAccounts': self.get('/accounts/search/', q=customer.name),
+            'overdueAccounts': self.get('/accounts/overdue/'),
+            'accountDetails': self.get(f'/account/get/{account.pk}/'),
+            'avatar': self.get(f'/avatar/list/{avatar}'),
+            'exportLedger': self.get('/ledger/export/'),
+            'exportLedgerXlsx': self.get('/ledger/export/', format='xlsx'),
+            'createAccountForm': self.get('/account/new/'),
+            'preCreationData': self.get('/account-precreation/data/'),
+            'productList': self.get('/product/list/'),
+            'sync': self.get('/sync/'),
+            'metrics': self.get('/metrics', client=self.anonymous, headers=metricsToken),
+            'createPayment': self.post(f'/account/get/{account.pk}/make-payment/', lambda: {
+                'paymentAmount': 1, 'receiptNumber': f'bench-{next(counter)}', 'paymentDate': str(account.saleDate),
+            }),
+            'createPayments': self.post('/payment/batch/', lambda: {'payments': [
+                {'account': account.pk, 'receiptId': f'bench-{next(counter)}', 'date': str(account.saleDate), 'amount': 1}
+                for _ in range(20)
+            ]}),
+            'importPayments': self.upload('/payment/import/', lambda: (
+                f'account,receiptId,date,amount\n{account.pk},bench-{next(counter)},{account.saleDate},1\n'.encode()
+            )),
+            'createCustomer': self.post('/customer/create/', lambda: {
+                'fullname': 'Bench Customer', 'phone': f'0199{next(counter):07d}', 'address': 'Bench',
+            }),
+            'createGuarantor': self.post('/guarantor/create/', lambda: {
+                'guarantorName': 'Bench Guarantor', 'guarantorPhone': f'0199{next(counter):07d}',
+            }),
+            'createAccount': self.post('/account/create/', lambda: {
+                'accountNumber': f'zzz-h{next(counter)}', 'customerUid': customer.uid, 'selectedModel': account.product_id,
+                'firstGuarantorUid': guarantor.uid, 'secondGuarantorUid': guarantor.uid, 'cashValue': 30000,
+                'hireValue': 36000, 'downPayment': 6000, 'monthlyPayment': 2500, 'length': 12,
+                'saleDate': str(account.saleDate),
+            }),
+            'createProduct': self.post('/product/create/', lambda: {
+                'category': 'Television', 'model': f'BENCH-{next(counter)}',
+            }),
+        }
+        if self.adminClient:
+            for name, model in [('adminCustomers', 'customer'), ('adminContracts', 'contract'), ('adminPayments', 'payment'),
+                    ('adminAccounts', 'account'), ('adminSummaries', 'accountsummary')]:
+                endpoints[name] = self.get(f'/admin/app/{model}/', client=self.adminClient)
+        return endpoints
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app.exports import csvLines, ledgerRows, parseDate, writeXlsx
+from app.routers import readsFromReplica
+
+
+class Command(BaseCommand):
+    help = "Export accounts, contracts and payments as a CSV or XLSX ledger, one row per payment."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file (.csv or .xlsx)")
+        parser.add_argument('--user', help="Only export accounts of this username")
+        parser.add_argument('--from', dest='date_from', help="First payment date (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='date_to', help="Last payment date (YYYY-MM-DD)")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def execute(self, *args, **options):
+        with readsFromReplica():  # When REPLICA_DATABASE_URL is set
+            return super().execute(*args, **options)
+
+    def handle(self, *args, **options):
+        creator = None
+        if options['user']:
+            creator = User.objects.filter(username=options['user']).first()
+            if not creator:
+                raise CommandError(f"User \"{options['user']}\" does not exist.")
+
+        try:
+            date_from = parseDate(options['date_from'])
+            date_to = parseDate(options['date_to'])
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+
+        rows = ledgerRows(creator, date_from, date_to, options['chunk_size'])
+        path = options['path']
+        try:
+            if path.lower().endswith('.xlsx'):
+                writeXlsx(rows, path)
+            else:
+                with open(path, 'w', newline='', encoding='utf-8') as file:
+                    file.writelines(csvLines(rows))
+        except (ImportError, OSError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"Ledger exported to {path}."))
@@ -0,0 +1,84 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.caching import bumpAllAccountVersions, bumpUserDataVersion
+from app.models import AccountSummary, Customer
+from app.utils import AVATAR_RENDITIONS, defaultAvatar, fileDigest
+
+
+AVATAR_FOLDER = 'customer/avatars/'
+
+
+class Command(BaseCommand):
+    help = "Delete avatar files (and their renditions) that no customer references anymore."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list what would be deleted")
+        parser.add_argument('--min-age', type=int, default=24,
+            help="Keep files younger than this many hours (uploads that aren't saved yet)")
+        parser.add_argument('--rehash', action='store_true',
+            help="First move avatars with legacy names to content-addressed names")
+
+    def handle(self, *args, **options):
+        if options['rehash']:
+            self.rehash(options['dry_run'])
+
+        referenced = set(Customer.objects.exclude(avatar='').values_list('avatar', flat=True).distinct())
+        referenced.add(defaultAvatar)
+        cutoff = time.time() - options['min_age'] * 3600
+
+        # Renditions (<stem>.<size>.<fmt>) live as long as their original is referenced
+        referencedStems = {Path(name).stem for name in referenced if name.startswith(AVATAR_FOLDER)}
+
+        storage = Customer._meta.get_field('avatar').storage
+        _, files = storage.listdir(AVATAR_FOLDER)
+        deleted = 0
+        for filename in files:
+            name = AVATAR_FOLDER + filename
+            stem = Path(filename).stem
+            if Path(stem).suffix.lstrip('.') in AVATAR_RENDITIONS:
+                if Path(stem).stem in referencedStems:
+                    continue
+            elif name in referenced:
+                continue
+
+            if storage.get_modified_time(name).timestamp() > cutoff:
+                continue
+
+            deleted += 1
+            self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleting'} {name}")
+            if not options['dry_run']:
+                storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(f"{deleted} unreferenced avatar files {'found' if options['dry_run'] else 'deleted'}."))
+
+    def rehash(self, dry_run):
+        storage = Customer._meta.get_field('avatar').storage
+        customers = Customer.objects.exclude(avatar='').exclude(avatar=defaultAvatar).only('uid', 'creator', 'avatar')
+        creators = set()
+
+        for customer in customers.iterator(chunk_size=500):
+            name = customer.avatar.name
+            if not storage.exists(name):
+                continue
+            with storage.open(name, 'rb') as file:
+                newName = f'{AVATAR_FOLDER}{fileDigest(file)}{Path(name).suffix.lower()}'
+                if newName == name:
+                    continue
+                self.stdout.write(f"Renaming {name} -> {newName}")
+                if dry_run:
+                    continue
+                storage.save(newName, file)
+
+            # update() skips the signals: touch updatedAt for delta sync, the versions are bumped below
+            Customer.objects.filter(pk=customer.pk).update(avatar=newName, updatedAt=timezone.now())
+            AccountSummary.objects.filter(account__customer_id=customer.pk).update(avatar=newName)
+            creators.add(customer.creator_id)
+
+        # Clients must drop cached pages and data naming the old files, they're deleted after --min-age
+        for creator_id in creators:
+            bumpUserDataVersion(creator_id)
+        bumpAllAccountVersions(creators)
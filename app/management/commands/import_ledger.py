@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app.importers import LedgerImporter, detectFormat, readRows
+
+
+class Command(BaseCommand):
+    help = (
+        "Onboard a shop from a CSV or JSONL ledger export, one account per row. Columns: "
+        "accountNumber, saleDate, isActive, remarks, customerName, customerPhone, customerAddress, "
+        "customerOccupation, guardianType, guardianName, guarantor1Name, guarantor1Phone, "
+        "guarantor1Address, guarantor1Occupation (same for guarantor2), productModel, productCategory, "
+        "cashValue, hireValue, downPayment, monthlyPayment, length."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file")
+        parser.add_argument('--user', required=True, help="Username (shop) that owns the imported records")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        creator = User.objects.filter(username=options['user']).first()
+        if not creator:
+            raise CommandError(f"User \"{options['user']}\" does not exist.")
+
+        fmt = options['format'] or detectFormat(options['path'])
+        importer = LedgerImporter(creator, options['batch_size'], progress=self._progress)
+        try:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(readRows(stream, fmt))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in report.asDict()['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['message']}")
+        if report.errorCount > len(report.errors):
+            self.stderr.write(f"... and {report.errorCount - len(report.errors)} more errors")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.created} of {report.processed} accounts "
+            f"({report.errorCount} errors, {report.rate:.0f} rows/sec)."
+        ))
+
+    def _progress(self, report):
+        self.stdout.write(f"  {report.processed} rows, {report.created} accounts, {report.rate:.0f} rows/sec")
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app.importers import ImportReport, detectFormat, importPayments, readRows
+
+
+class Command(BaseCommand):
+    help = "Import payments from a CSV or JSONL file with account, receiptId, date and amount columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--user', help="Only accept payments for accounts of this username")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        creator = None
+        if options['user']:
+            creator = User.objects.filter(username=options['user']).first()
+            if not creator:
+                raise CommandError(f"User \"{options['user']}\" does not exist.")
+
+        fmt = options['format'] or detectFormat(options['path'])
+        report = ImportReport()
+        try:
+            with open(options['path'], 'rb') as stream:
+                importPayments(readRows(stream, fmt), creator, options['batch_size'], report)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in report.asDict()['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['message']}")
+        if report.errorCount > len(report.errors):
+            self.stderr.write(f"... and {report.errorCount - len(report.errors)} more errors")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.created} of {report.processed} payments "
+            f"({report.errorCount} errors, {report.rate:.0f} rows/sec)."
+        ))
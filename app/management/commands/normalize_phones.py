@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import Customer, Guarantor
+from app.utils import normalizePhone
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the normalized phone (phoneE164) of customers and guarantors in batches. "
+        "Rows whose number can't be parsed, or that normalize to a number another row of "
+        "the same shop already has, are left empty and reported for manual merging."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows written per query")
+        parser.add_argument('--dry-run', action='store_true', help="Only report, don't write")
+
+    def handle(self, *args, **options):
+        for model in (Customer, Guarantor):
+            self.backfill(model, options['batch_size'], options['dry_run'])
+
+    def backfill(self, model, batch_size, dry_run):
+        label = model._meta.verbose_name_plural
+        # (creator, normalized phone) -> uid of the row owning it
+        taken = {(creator_id, phone): uid for uid, creator_id, phone in
+            model.objects.exclude(phoneE164=None).values_list('uid', 'creator_id', 'phoneE164').iterator()}
+
+        pending = model.objects.filter(phoneE164=None).order_by('uid')
+        updated = collisions = invalid = 0
+        lastUid = None
+        while True:
+            rows = pending.filter(uid__gt=lastUid) if lastUid is not None else pending
+            rows = list(rows.values_list('uid', 'creator_id', 'phone')[:batch_size])
+            if not rows:
+                break
+            lastUid = rows[-1][0]
+
+            batch = []
+            for uid, creator_id, phone in rows:
+                normalized = normalizePhone(phone)
+                if not normalized:
+                    if phone:  # Guarantors may have no phone at all
+                        invalid += 1
+                        self.stdout.write(f"  {label} {uid}: can't normalize \"{phone}\"")
+                    continue
+                owner = taken.setdefault((creator_id, normalized), uid)
+                if owner != uid:
+                    collisions += 1
+                    self.stdout.write(self.style.WARNING(
+                        f"  {label} {uid}: \"{phone}\" is {normalized}, already used by {owner}"))
+                    continue
+                batch.append(model(uid=uid, phoneE164=normalized))
+
+            if batch and not dry_run:
+                with transaction.atomic():
+                    model.objects.bulk_update(batch, ['phoneE164'])
+            updated += len(batch)
+
+        verb = "Would normalize" if dry_run else "Normalized"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {updated} {label}; {collisions} collisions, {invalid} invalid numbers."))
@@ -0,0 +1,53 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app.arrears import computeArrears, loadContracts, overdueAccounts
+from app.exports import parseDate
+from app.routers import readsFromReplica
+
+
+class Command(BaseCommand):
+    help = "List active accounts that are behind their installment schedule."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only accounts of this username")
+        parser.add_argument('--as-of', help="Reference date (YYYY-MM-DD), defaults to today")
+        parser.add_argument('--min-months', type=int, default=1, help="Minimum installments overdue")
+        parser.add_argument('--limit', type=int)
+        parser.add_argument('--timing', action='store_true', help="Report load and compute times")
+
+    def execute(self, *args, **options):
+        with readsFromReplica():  # When REPLICA_DATABASE_URL is set
+            return super().execute(*args, **options)
+
+    def handle(self, *args, **options):
+        creator = None
+        if options['user']:
+            creator = User.objects.filter(username=options['user']).first()
+            if not creator:
+                raise CommandError(f"User \"{options['user']}\" does not exist.")
+        try:
+            as_of = parseDate(options['as_of'])
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+
+        if options['timing']:
+            started = time.perf_counter()
+            contracts = loadContracts(creator)
+            loaded = time.perf_counter()
+            computeArrears(contracts, as_of)
+            computed = time.perf_counter()
+            self.stdout.write(
+                f"{len(contracts['accountNumber'])} contracts: "
+                f"load {loaded - started:.3f}s, compute {computed - loaded:.4f}s"
+            )
+
+        accounts = overdueAccounts(creator, as_of, options['min_months'], options['limit'])
+        for account in accounts:
+            self.stdout.write(
+                f"{account['accountNumber']:<12} {account['name'][:30]:<30} {account['phone']:<14} "
+                f"arrears {account['arrears']:>8}  months {account['monthsOverdue']:>3}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(accounts)} overdue accounts."))
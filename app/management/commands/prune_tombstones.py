@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.sync import pruneTombstones
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the delta sync tombstones older than SYNC_TOMBSTONE_DAYS. Clients that haven't "
+        "synced for longer get a full sync instead. Meant to run daily (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYNC_TOMBSTONE_DAYS, help="Keep tombstones this many days")
+
+    def handle(self, *args, **options):
+        deleted = pruneTombstones(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones."))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import Account, AccountSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the AccountSummary read model from Account, Customer and Contract in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Accounts written per query")
+        parser.add_argument('--clear', action='store_true', help="Delete all summaries before rebuilding")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['clear']:
+            deleted, _ = AccountSummary.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} summaries.")
+
+        accounts = (Account.objects
+            .select_related('customer', 'contract')
+            .only('accountNumber', 'creator_id', 'isActive', 'customer__name', 'customer__phone',
+                'customer__avatar', 'contract__cashBalance')
+            .order_by('accountNumber'))
+
+        total = 0
+        batch = []
+        for account in accounts.iterator(chunk_size=batch_size):
+            batch.append(account)
+            if len(batch) >= batch_size:
+                total += self._write(batch)
+                batch = []
+        total += self._write(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} account summaries."))
+
+    def _write(self, batch):
+        with transaction.atomic():
+            written = AccountSummary.sync(batch)
+        if written:
+            self.stdout.write(f"  {written} summaries written (last: {batch[-1].accountNumber})")
+        return written
@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import ShopStats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the dashboard totals (ShopStats) from Account and Payment. "
+        "Meant to run nightly (e.g. from cron) to correct any drift of the incremental updates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only this username")
+
+    def handle(self, *args, **options):
+        creators = None
+        if options['user']:
+            creator = User.objects.filter(username=options['user']).first()
+            if not creator:
+                raise CommandError(f"User \"{options['user']}\" does not exist.")
+            creators = [creator.pk]
+
+        count = ShopStats.reconcile(creators)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled stats of {count} shops."))
@@ -0,0 +1,148 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app.importers import LedgerImporter, batched
+from app.models import Account, AccountSummary, Contract, Payment
+from app.utils import OCCUPATIONS, PRODUCT_CATEGORIES
+
+
+FIRST_NAMES = ['Mohammad', 'Abdul', 'Md', 'Rahim', 'Karim', 'Jamal', 'Kamal', 'Hasan', 'Hossain', 'Rafiq',
+    'Shafiq', 'Nazmul', 'Sabbir', 'Tanvir', 'Rina', 'Shirin', 'Nasrin', 'Fatema', 'Ayesha', 'Rokeya',
+    'Salma', 'Sumaiya', 'Taslima', 'Monir', 'Jahid', 'Arif', 'Sohel', 'Liton', 'Babul', 'Anwar']
+LAST_NAMES = ['Uddin', 'Islam', 'Hossain', 'Rahman', 'Ahmed', 'Khan', 'Mia', 'Sarkar', 'Chowdhury', 'Sheikh',
+    'Talukder', 'Mollah', 'Akter', 'Begum', 'Khatun', 'Bhuiyan', 'Haque', 'Alam', 'Kabir', 'Sultana']
+AREAS = ['Mirpur', 'Uttara', 'Mohammadpur', 'Dhanmondi', 'Badda', 'Rampura', 'Jatrabari', 'Savar', 'Tongi',
+    'Gazipur', 'Narayanganj', 'Keraniganj', 'Ashulia', 'Bashundhara', 'Khilgaon']
+BRANDS = ['WALTON', 'SAMSUNG', 'LG', 'SINGER', 'VISION', 'MINISTER', 'SHARP', 'HAIER']
+LENGTHS = [6, 9, 12, 12, 12, 18, 24]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic shops for benchmarking (see the bench command): users, "
+        "customers, guarantors, products, accounts with contracts and their monthly payments, "
+        "written with bulk inserts. About 8 payments per account: --users 12 --accounts 10000 gives ~1M payments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help="Number of shops")
+        parser.add_argument('--accounts', type=int, default=1000, help="Accounts per shop (max 99999)")
+        parser.add_argument('--years', type=int, default=3, help="Sales are spread over this many past years")
+        parser.add_argument('--prefix', default='bench', help="Usernames are <prefix>-<n>, password is the prefix")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed, the same seed gives the same data")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not 0 < options['accounts'] < 100000:
+            raise CommandError("--accounts must be between 1 and 99999 (account numbers are xxx-hNNNNN).")
+
+        usernames = [f"{options['prefix']}-{n}" for n in range(options['users'])]
+        existing = User.objects.filter(username__in=usernames).values_list('username', flat=True)
+        if existing:
+            raise CommandError(f"Users already exist: {', '.join(existing)}. Use another --prefix.")
+
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        totals = {'accounts': 0, 'payments': 0}
+        for n, username in enumerate(usernames):
+            user = User.objects.create_user(username, password=options['prefix'])
+            prefix = ''.join(chr(ord('a') + (n // 26 ** i) % 26) for i in (2, 1, 0))
+
+            rows = (self.ledgerRow(prefix, i, options['accounts'], options['years']) for i in range(options['accounts']))
+            report = LedgerImporter(user, self.batch_size).run(enumerate(rows, 1))
+            payments = self.seedPayments(user)
+
+            totals['accounts'] += report.created
+            totals['payments'] += payments
+            self.stdout.write(f"  {username}: {report.created} accounts, {payments} payments")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(usernames)} shops, {totals['accounts']} accounts and {totals['payments']} payments "
+            f"in {time.monotonic() - started:.0f}s."
+        ))
+
+    def person(self, index):
+        # The same index always gives the same name, for customers and guarantors seen again
+        rnd = random.Random(index)
+        return f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}'
+
+    def address(self):
+        return f'House {self.random.randint(1, 200)}, Road {self.random.randint(1, 30)}, {self.random.choice(AREAS)}'
+
+    def ledgerRow(self, prefix, i, accounts, years):
+        rnd = self.random
+        # ~10% of the accounts belong to a returning customer; guarantors come from a smaller pool
+        customer = rnd.randrange(i) if i and rnd.random() < 0.1 else i
+        guarantors = [rnd.randrange(max(accounts // 3, 1)) for _ in range(2)]
+
+        category = rnd.choice(PRODUCT_CATEGORIES)[0]
+        cashValue = int(min(max(rnd.lognormvariate(10.2, 0.6), 5000), 250000)) // 100 * 100
+        hireValue = int(cashValue * rnd.uniform(1.15, 1.35)) // 100 * 100
+        downPayment = int(hireValue * rnd.uniform(0.1, 0.3)) // 100 * 100
+        length = rnd.choice(LENGTHS)
+
+        row = {
+            'accountNumber': f'{prefix}-h{i + 1}',
+            'saleDate': str(date.today() - timedelta(days=int(rnd.random() * 365 * years))),
+            'customerName': self.person(customer),
+            'customerPhone': f'017{customer:08d}',
+            'customerAddress': self.address(),
+            'customerOccupation': rnd.choice(OCCUPATIONS)[0],
+            'productModel': f'{rnd.choice(BRANDS)}-{category[:3].upper()}-{rnd.randint(1, 40)}',
+            'productCategory': category,
+            'cashValue': cashValue,
+            'hireValue': hireValue,
+            'downPayment': downPayment,
+            'monthlyPayment': -(-(hireValue - downPayment) // length),
+            'length': length,
+        }
+        for n, guarantor in enumerate(guarantors, 1):
+            row[f'guarantor{n}Name'] = self.person(-guarantor - 1)
+            row[f'guarantor{n}Phone'] = f'018{guarantor:08d}'
+            row[f'guarantor{n}Address'] = self.address()
+        return row
+
+    def seedPayments(self, user):
+        """ Monthly payments from the sale date on; each account has its own punctuality. """
+        rnd = self.random
+        today = date.today()
+        contracts = (Account.objects.filter(creator=user).order_by('pk')
+            .values_list('pk', 'contract_id', 'saleDate', 'contract__hireValue', 'contract__downPayment', 'contract__monthlyPayment'))
+
+        count = 0
+        paidOff = []
+        pending = []
+        for accountNumber, contract_id, saleDate, hireValue, downPayment, monthly in contracts.iterator():
+            remaining = hireValue - downPayment
+            punctuality = rnd.betavariate(5, 1.5)
+            day = saleDate + timedelta(days=30)
+            while day <= today and remaining > 0:
+                if rnd.random() < punctuality:
+                    amount = min(remaining, monthly * rnd.choice([1, 1, 1, 1, 2]) if rnd.random() > 0.1 else monthly // 2)
+                    remaining -= amount
+                    count += 1
+                    pending.append(Payment(contract_id=contract_id, receiptId=f'{user.username}-{count}', date=day, amount=amount))
+                day += timedelta(days=30 + rnd.randint(-5, 5))
+            if remaining <= 0:
+                paidOff.append(accountNumber)
+
+            if len(pending) >= self.batch_size:
+                Payment.objects.bulk_create(pending)
+                pending = []
+        Payment.objects.bulk_create(pending)
+
+        for batch in batched(paidOff, self.batch_size):
+            with transaction.atomic():
+                Account.objects.filter(pk__in=batch).update(isActive=False)
+                AccountSummary.objects.filter(account__in=batch).update(isActive=False)
+
+        # bulk_create skipped the signals: rebuild balances, summaries and shop stats in one go
+        Contract.recalculateMany(Account.objects.filter(creator=user).values_list('contract_id', flat=True), self.batch_size)
+        return count
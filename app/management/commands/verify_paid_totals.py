@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from app.models import Contract
+
+
+class Command(BaseCommand):
+    help = "Compare every Contract.paidTotal with the real sum of its payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Rewrite drifted contracts from the payment sum")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        contracts = (Contract.objects
+            .annotate(actualPaid=Coalesce(Sum('payments__amount'), Value(0)))
+            .exclude(paidTotal=F('actualPaid'))
+            .values_list('pk', 'uid', 'paidTotal', 'actualPaid')
+            .order_by('pk'))
+
+        drifted = 0
+        for pk, uid, stored, actual in contracts.iterator(chunk_size=options['batch_size']):
+            drifted += 1
+            self.stdout.write(f"Contract {uid or pk}: stored {stored}, actual {actual}")
+
+            if options['fix']:
+                Contract.objects.get(pk=pk).recalculate()
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All contract paid totals match their payments."))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {drifted} contracts."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{drifted} contracts drifted. Run with --fix to repair them."))
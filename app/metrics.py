@@ -0,0 +1,255 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .profiling import watchQueries
+
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+AVATAR_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'cms_http_requests_total': ('counter', 'Requests by URL name, method and status.', None),
+    'cms_http_request_duration_seconds': ('histogram', 'Request latency by URL name and method.', LATENCY_BUCKETS),
+    'cms_http_request_db_queries': ('histogram', 'Database queries per request by URL name.', QUERY_BUCKETS),
+    'cms_payments_posted_total': ('counter', 'Committed payments by source (single, import or batch).', None),
+    'cms_avatar_compress_seconds': ('histogram', 'Time spent compressing uploaded avatars.', AVATAR_BUCKETS),
+    'cms_avatar_bytes_saved_total': ('counter', 'Upload bytes saved by avatar compression.', None),
+    'cms_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).', None),
+    'cms_cache_hit_ratio': ('gauge', 'Hits over lookups of cms_cache_requests_total, by cache.', None),
+}
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class Store:
+    """
+    Metrics of this process. A background thread flushes them to the process's own
+    <pid>.json in METRICS_DIR every METRICS_FLUSH_INTERVAL seconds, off the request
+    path; scrapes and exit flush too. The /metrics view sums the files of all the
+    workers. Files of workers that exited stay, so counters never go down; empty the
+    directory when the server (re)starts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fileLock = threading.Lock()
+        self.values = {}  # (name, labels) -> value, or [bucket counts..., +Inf count, sum] for histograms
+        self.dirty = False
+        self.flusherPid = None  # Threads don't survive a fork, every worker starts its own
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labelKey(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self._changed()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, _labelKey(labels))
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(buckets) + 2)
+            counts[bisect_left(buckets, value)] += 1  # Bucket bounds are inclusive (le)
+            counts[-1] += value
+            self._changed()
+
+    def clear(self):
+        """ Forget everything recorded without writing it, for tests. """
+        with self.fileLock, self.lock:
+            self.values = {}
+            self.dirty = False
+
+    def _changed(self):
+        # Called with the lock held
+        self.dirty = True
+        if self.flusherPid != os.getpid():
+            self.flusherPid = os.getpid()
+            threading.Thread(target=self._flushPeriodically, name='metrics-flush', daemon=True).start()
+
+    def _flushPeriodically(self):
+        while True:
+            time.sleep(getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0))
+            try:
+                self.flush()
+            except OSError:  # e.g. METRICS_DIR not writable, retried at the next interval
+                pass
+
+    def flush(self):
+        """ Write the metrics to this process's file, if they changed since the last flush. """
+        with self.fileLock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+                entries = [[name, labels, value] for (name, labels), value in self.values.items()]
+
+            directory = metricsDir()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{os.getpid()}.json')
+            with open(f'{path}.tmp', 'w') as file:
+                json.dump(entries, file)
+            os.replace(f'{path}.tmp', path)  # Readers never see a half written file
+
+
+def _labelKey(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def metricsDir():
+    return str(getattr(settings, 'METRICS_DIR', None) or os.path.join(settings.BASE_DIR, '.metrics'))
+
+
+store = Store()
+inc = store.inc
+observe = store.observe
+
+
+@atexit.register
+def _flushOnExit():
+    store.flush()  # Nothing to write when nothing was recorded, e.g. management commands
+
+
+def cacheLookup(cache, hit):
+    inc('cms_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+# ++++++++++++++++ EXPOSITION +++++++++++++++++++
+
+def collect():
+    """ Sum of the metrics of every worker: {(name, labels): value}. """
+    store.flush()
+    directory = metricsDir()
+    merged = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):  # Removed meanwhile
+            continue
+
+        for name, labels, value in entries:
+            if name not in METRICS:
+                continue  # Dropped since the file was written
+            key = (name, tuple(tuple(label) for label in labels))
+            if isinstance(value, list):
+                if len(value) != len(METRICS[name][2]) + 2:
+                    continue  # Buckets changed since the file was written
+                merged[key] = [a + b for a, b in zip(merged.get(key, [0] * len(value)), value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+    lookups = {}
+    for (name, labels), value in merged.items():
+        if name == 'cms_cache_requests_total':
+            labels = dict(labels)
+            hits, total = lookups.get(labels['cache'], (0, 0))
+            lookups[labels['cache']] = (hits + (value if labels['result'] == 'hit' else 0), total + value)
+    for cache, (hits, total) in lookups.items():
+        merged[('cms_cache_hit_ratio', (('cache', cache),))] = hits / total if total else 0.0
+    return merged
+
+
+def exposition():
+    """ collect() in the Prometheus text format. """
+    series = {}
+    for (name, labels), value in collect().items():
+        series.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series.get(name, []), key=lambda item: item[0]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_formatLabels(labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (math.inf,), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_formatLabels(labels + (("le", _number(bound)),))} {_number(cumulative)}')
+            lines.append(f'{name}_sum{_formatLabels(labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_formatLabels(labels)} {_number(cumulative)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# ++++++++++++++++ REQUESTS +++++++++++++++++++
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def viewName(request):
+    """ URL name of the request, its route when unnamed; a bounded set of label values. """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name if match.url_name else match.route
+
+
+class MetricsMiddleware:
+    """ Latency and query count of every request, by URL name (see app/urls.py). """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.isAsync = iscoroutinefunction(get_response)
+        if self.isAsync:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.isAsync:
+            return self.__acall__(request)
+        counter, started = QueryCounter(), time.perf_counter()
+        with watchQueries(counter):
+            response = self.get_response(request)
+        return self.record(request, response, counter, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        counter, started = QueryCounter(), time.perf_counter()
+        with watchQueries(counter):
+            response = await self.get_response(request)
+        return self.record(request, response, counter, time.perf_counter() - started)
+
+    def record(self, request, response, counter, elapsed):
+        view = viewName(request)
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        observe('cms_http_request_duration_seconds', elapsed, view=view, method=method)
+        observe('cms_http_request_db_queries', counter.count, view=view)
+        inc('cms_http_requests_total', view=view, method=method, status=response.status_code)
+        return response
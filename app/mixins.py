@@ -0,0 +1,69 @@
+from django.db.models.fields.files import FieldFile
+
+
+class TrackedFieldsMixin:
+    """
+    Remembers the field values an instance was loaded with, so save paths can
+    tell what changed without re-reading the row.
+
+        instance.changed_fields     names of fields that differ from the loaded values
+        instance.previous('field')  value the field was loaded with (None if unknown)
+
+    Saving a loaded instance only writes its changed fields (and auto_now fields).
+    An explicit update_fields is narrowed down to the changed ones the same way.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _trackedValue(self, field):
+        value = self.__dict__.get(field.attname)
+        if isinstance(value, FieldFile):
+            return value.name if value._committed else object()  # A pending upload always differs
+        return value
+
+    def _snapshot(self, fields=None):
+        if not hasattr(self, '_loadedValues'):
+            self._loadedValues = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields):
+                self._loadedValues[field.attname] = self._trackedValue(field)
+
+    def previous(self, field):
+        return getattr(self, '_loadedValues', {}).get(self._meta.get_field(field).attname)
+
+    @property
+    def changed_fields(self):
+        loaded = getattr(self, '_loadedValues', None)
+        if loaded is None:
+            return [field.name for field in self._meta.concrete_fields]
+
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+            and (field.attname not in loaded or loaded[field.attname] != self._trackedValue(field))
+        ]
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot(fields and {self._meta.get_field(name).name for name in fields})
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loadedValues', None)
+        isUpdate = (
+            not self._state.adding and loaded is not None and not kwargs.get('force_insert')
+            and loaded.get(self._meta.pk.attname) == self.pk  # A changed pk is saved as usual
+        )
+
+        if isUpdate:
+            fields = set(self.changed_fields)
+            if kwargs.get('update_fields') is not None:
+                fields &= {self._meta.get_field(name).name for name in kwargs['update_fields']}
+            fields |= {field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)}
+            kwargs['update_fields'] = fields
+
+        super().save(*args, **kwargs)
+        self._snapshot()
@@ -1,21 +1,101 @@
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import IntegrityError, transaction, connections, router
 import re as regex
+import threading
 
 from .utils import defaultAvatar, GUARDIAN_TYPES, OCCUPATIONS, PRODUCT_CATEGORIES
-from .utils import compressAvatar, customerAvatarPath
+from .utils import CUSTOMER_UID_FLOOR, GUARANTOR_UID_FLOOR
+from .utils import compressAvatar, customerAvatarPath, avatarStorage, normalizePhone
+from .mixins import TrackedFieldsMixin
+from .caching import bumpAllAccountVersions
 
 
-class Customer(models.Model):
+
+class UidCounter(models.Model):
+    """
+    Last uid handed out for models with custom numbering (Customer, Guarantor).
+    Uids are reserved with a single UPDATE ... RETURNING, so concurrent workers
+    never receive overlapping values and no MAX(uid) scan is needed.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    lastValue = models.BigIntegerField()
+
+    # Per-process blocks: {name: (next uid, end of block)}
+    _blocks = {}
+    _blocksLock = threading.Lock()
+
+    def __str__(self):
+        return f'{self.name}: {self.lastValue}'
+
+    @classmethod
+    def reserve(cls, model, floor, count=1):
+        """ Reserve `count` consecutive uids for `model` and return the first one. """
+        name = model._meta.label_lower
+        connection = connections[router.db_for_write(cls)]
+        qn = connection.ops.quote_name
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {qn(cls._meta.db_table)} SET {qn("lastValue")} = {qn("lastValue")} + %s '
+                f'WHERE {qn("name")} = %s RETURNING {qn("lastValue")}',
+                [count, name]
+            )
+            row = cursor.fetchone()
+
+        if row is None:  # First use, start after the highest existing uid
+            current = model.objects.aggregate(models.Max('uid'))['uid__max'] or floor
+            cls.objects.get_or_create(name=name, defaults={'lastValue': max(current, floor)})
+            return cls.reserve(model, floor, count)
+        return row[0] - count + 1
+
+    @classmethod
+    def next(cls, model, floor):
+        """
+        Next uid for `model`. With settings.UID_BLOCK_SIZE > 1 each process reserves
+        a block at a time; unused uids of a block are skipped when the process exits.
+        """
+        blockSize = getattr(settings, 'UID_BLOCK_SIZE', 1)
+        if blockSize <= 1:
+            return cls.reserve(model, floor)
+
+        name = model._meta.label_lower
+        with cls._blocksLock:
+            uid, end = cls._blocks.get(name, (0, 0))
+            if uid >= end:
+                uid = cls.reserve(model, floor, blockSize)
+                end = uid + blockSize
+            cls._blocks[name] = (uid + 1, end)
+        return uid
+
+
+def cleanPhone(instance):
+    """
+    clean() of customers and guarantors: normalize the phone before validation, and report
+    a number the shop already has in another format as a phone error. phoneE164 isn't
+    editable, so forms leave it out of validate_constraints and the IntegrityError would be a 500.
+    """
+    instance.phoneE164 = normalizePhone(instance.phone)
+    if instance.phoneE164 and instance.creator_id is not None:
+        taken = type(instance).objects.filter(creator_id=instance.creator_id, phoneE164=instance.phoneE164)
+        if taken.exclude(pk=instance.pk).exists():
+            raise ValidationError({'phone': f'A {instance._meta.verbose_name} of this shop already has this phone number.'})
+
+
+
+class Customer(TrackedFieldsMixin, models.Model):
     uid = models.BigIntegerField(primary_key=True, unique=True, editable=False)
     creator = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='customers')
 
     name = models.CharField(max_length=100) #required
     age = models.PositiveIntegerField(blank=True, null=True)
-    avatar = models.ImageField(upload_to=customerAvatarPath, blank=True, null=True, default=defaultAvatar)
+    avatar = models.ImageField(upload_to=customerAvatarPath, storage=avatarStorage, blank=True, null=True, default=defaultAvatar)
     phone = models.CharField(max_length=14, help_text="Format: +880XXXXXXXXXX") #required
+    phoneE164 = models.CharField(max_length=16, blank=True, null=True, editable=False, help_text="Normalized phone, see normalizePhone")
     occupation = models.CharField(max_length=100, choices=OCCUPATIONS, blank=True, null=True)
     
     guardianType = models.CharField(max_length=10, choices=GUARDIAN_TYPES, blank=True, null=True)
@@ -23,20 +103,24 @@ class Customer(models.Model):
 
     address = models.CharField(max_length=500) #required
     locationMark = models.CharField(max_length=500, blank=True, null=True)
+    updatedAt = models.DateTimeField(auto_now=True, help_text="Last change, for delta sync (app/sync.py)")
 
     def _avatar_needs_compression(self):
         """ Check if the avatar needs to be compressed (only if it has changed). """
-        if not self.pk:  # New profile, avatar needs processing
+        if self._state.adding:  # New profile, avatar needs processing
             return True
-        old_avatar = Customer.objects.filter(pk=self.pk).first()
-        return old_avatar.avatar != self.avatar if old_avatar else True
+        return 'avatar' in self.changed_fields
+
+    def clean(self):
+        cleanPhone(self)
 
     def save(self, *args, **kwargs):
         if not self.uid: #Set custom uid
-            with transaction.atomic():  # Ensures safe execution
-                max_uid = Customer.objects.aggregate(models.Max('uid'))['uid__max']
-                self.uid = (max_uid or 1000000) + 1
-        
+            self.uid = UidCounter.next(Customer, CUSTOMER_UID_FLOOR)
+
+        self.phoneE164 = normalizePhone(self.phone)
+        if kwargs.get('update_fields') is not None and 'phone' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'phoneE164'}
 
         #Compress avatar image on condition
         if self.avatar and self._avatar_needs_compression():
@@ -52,6 +136,12 @@ class Customer(models.Model):
 
     class Meta:
         ordering = ['-uid']
+        constraints = [
+            models.UniqueConstraint(fields=['creator', 'phoneE164'], name='customer_creator_phone_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['creator', 'updatedAt'], name='customer_creator_updated_idx'),
+        ]
 
 
 
@@ -69,7 +159,7 @@ class Product(models.Model):
     
 
 
-class Contract(models.Model):
+class Contract(TrackedFieldsMixin, models.Model):
     uid = models.CharField(max_length=100, unique=True, blank=True, null=True)
 
     cashValue = models.PositiveIntegerField(help_text="Total cash value")
@@ -81,11 +171,78 @@ class Contract(models.Model):
 
     cashBalance = models.IntegerField(help_text="Remaining cash balance", editable=False)
     hireBalance = models.IntegerField(help_text="Remaining hire balance", editable=False)
+    paidTotal = models.PositiveIntegerField(default=0, editable=False, help_text="Sum of all payments (excluding down payment)")
+    updatedAt = models.DateTimeField(auto_now=True, db_index=True, help_text="Last change, for delta sync (app/sync.py)")
 
     @property
     def totalPaid(self):
-        payments = self.payments.aggregate(models.Sum('amount'))['amount__sum'] or 0
-        return payments + self.downPayment
+        return self.paidTotal + self.downPayment
+
+    def aggregatePaid(self):
+        """ True sum of the payments, used to verify the stored paidTotal. """
+        return self.payments.aggregate(models.Sum('amount'))['amount__sum'] or 0
+
+    @classmethod
+    def applyPayment(cls, pk, amount, contract=None):
+        """
+        Add `amount` (negative to reverse a payment) to paidTotal and subtract it from
+        both balances (and touch updatedAt) in one UPDATE ... RETURNING. The row lock taken by the UPDATE
+        serializes concurrent postings on the same contract, and positive amounts are
+        only applied while they fit into the hire balance.
+        Returns the new (paidTotal, cashBalance, hireBalance), or None if it didn't fit.
+        The in-memory `contract`, when given, is updated with the new values, as loaded ones.
+        """
+        connection = connections[router.db_for_write(cls)]
+        qn = connection.ops.quote_name
+        paid, cash, hire = qn('paidTotal'), qn('cashBalance'), qn('hireBalance')
+
+        sql = (f'UPDATE {qn(cls._meta.db_table)} SET {paid} = {paid} + %s, {cash} = {cash} - %s, {hire} = {hire} - %s, '
+               f'{qn("updatedAt")} = %s WHERE {qn("id")} = %s')
+        params = [amount, amount, amount, connection.ops.adapt_datetimefield_value(timezone.now()), pk]
+        if amount > 0:
+            sql += f' AND {hire} >= %s'
+            params.append(amount)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql + f' RETURNING {paid}, {cash}, {hire}', params)
+            row = cursor.fetchone()
+
+        if row and contract is not None:
+            contract.paidTotal, contract.cashBalance, contract.hireBalance = row
+            contract._snapshot({'paidTotal', 'cashBalance', 'hireBalance'})  # Already saved, not changes of a later save()
+        return row
+
+    @classmethod
+    def recalculateMany(cls, pks, batch_size=1000):
+        """ Rebuild paidTotal and the balances of many contracts from their payments, set-based. """
+        pks = list(pks)
+        paid = Coalesce(models.Subquery(
+            Payment.objects.filter(contract=models.OuterRef('pk'))
+                .order_by().values('contract').annotate(total=models.Sum('amount')).values('total')
+        ), 0)
+        contractBalance = models.Subquery(
+            Account.objects.filter(pk=models.OuterRef('account_id')).values('contract__cashBalance')
+        )
+
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            with transaction.atomic():
+                cls.objects.filter(pk__in=batch).update(
+                    paidTotal=paid,
+                    cashBalance=models.F('cashValue') - models.F('downPayment') - paid,
+                    hireBalance=models.F('hireValue') - models.F('downPayment') - paid,
+                    updatedAt=timezone.now(),
+                )
+                AccountSummary.objects.filter(account__contract_id__in=batch).update(cashBalance=contractBalance)
+
+        creators = list(Account.objects.filter(contract_id__in=pks).values_list('creator_id', flat=True).distinct())
+        ShopStats.reconcile(creators)
+        transaction.on_commit(lambda: bumpAllAccountVersions(creators))
+
+    def recalculate(self):
+        """ Rebuild paidTotal and the balances from the payments. """
+        Contract.recalculateMany([self.pk])
+        self.refresh_from_db(fields=['paidTotal', 'cashBalance', 'hireBalance'])
 
     class Meta:
         ordering = ['-id']
@@ -106,6 +263,11 @@ class Contract(models.Model):
                 self.hireBalance = self.hireValue - self.downPayment
 
             else:  # Contract is being updated
+                # paidTotal and the balances are maintained by the payment signals, never trust a stale
+                # in-memory copy: the locked row is what this save changes, for the ShopStats delta too
+                self.paidTotal, self.cashBalance, self.hireBalance = (Contract.objects.select_for_update()
+                    .values_list('paidTotal', 'cashBalance', 'hireBalance').get(pk=self.pk))
+                self._snapshot({'paidTotal', 'cashBalance', 'hireBalance'})
                 self.cashBalance = self.cashValue - self.totalPaid
                 self.hireBalance = self.hireValue - self.totalPaid
             super().save(*args, **kwargs)
@@ -117,11 +279,12 @@ class Contract(models.Model):
 
 
 
-class Payment(models.Model):
+class Payment(TrackedFieldsMixin, models.Model):
     contract = models.ForeignKey(Contract, on_delete=models.CASCADE, related_name='payments')
     date = models.DateField(help_text="Date of the payment")
     receiptId = models.CharField(max_length=100, unique=True, help_text="Receipt ID for the payment")
     amount = models.PositiveIntegerField(help_text="Amount of the payment")
+    updatedAt = models.DateTimeField(auto_now=True, db_index=True, help_text="Last change, for delta sync (app/sync.py)")
 
     def __str__(self):
         if hasattr(self.contract, 'account'):
@@ -132,13 +295,23 @@ class Payment(models.Model):
         ordering = ['-date']
 
     def clean(self):
-        # Validate payment amount does not exceed remaining balances
-        if self.amount > self.contract.hireBalance:
+        # Validate payment amount does not exceed remaining balances; all of it when moved to another contract
+        previous = self.previous('amount') if self.previous('contract') == self.contract_id else 0
+        if self.amount - (previous or 0) > self.contract.hireBalance:
             raise ValidationError("Payment amount exceeds remaining balance.")
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super().save(*args, **kwargs)
+        # The contract FK and the unique receiptId are enforced by the database, skip their queries
+        self.full_clean(exclude=['contract'], validate_unique=False)
+
+        # Signals update the contract balances, roll the payment back if that fails
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError:
+            if Payment.objects.filter(receiptId=self.receiptId).exclude(pk=self.pk).exists():
+                raise ValidationError({'receiptId': f'"{self.receiptId}" this receipt ID already exists.'})
+            raise
 
 
 
@@ -148,25 +321,38 @@ class Guarantor(models.Model):
     
     name = models.CharField(max_length=100)  #required
     phone = models.CharField(max_length=14, help_text="Format: +880XXXXXXXXXX", blank=True, null=True)
+    phoneE164 = models.CharField(max_length=16, blank=True, null=True, editable=False, help_text="Normalized phone, see normalizePhone")
     address = models.CharField(max_length=500, blank=True, null=True)
     occupation = models.CharField(max_length=100, choices=OCCUPATIONS, blank=True, null=True)
+    updatedAt = models.DateTimeField(auto_now=True, help_text="Last change, for delta sync (app/sync.py)")
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ['-uid']
+        constraints = [
+            models.UniqueConstraint(fields=['creator', 'phoneE164'], name='guarantor_creator_phone_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['creator', 'updatedAt'], name='guarantor_creator_updated_idx'),
+        ]
+
+    def clean(self):
+        cleanPhone(self)
 
     def save(self, *args, **kwargs):
         if not self.uid:
-            with transaction.atomic(): # Ensures safe execution
-                max_uid = Guarantor.objects.aggregate(models.Max('uid'))['uid__max']
-                self.uid = (max_uid or 5000000) + 1
+            self.uid = UidCounter.next(Guarantor, GUARANTOR_UID_FLOOR)
+
+        self.phoneE164 = normalizePhone(self.phone)
+        if kwargs.get('update_fields') is not None and 'phone' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'phoneE164'}
         super().save(*args, **kwargs)
 
 
 
-class Account(models.Model):
+class Account(TrackedFieldsMixin, models.Model):
     accountNumber = models.CharField(max_length=10, primary_key=True, unique=True)
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='accounts')
 
@@ -180,23 +366,27 @@ class Account(models.Model):
 
     remarks = models.TextField(blank=True, null=True, help_text="Notes about this account")
     timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Creation date and time")
+    updatedAt = models.DateTimeField(auto_now=True, help_text="Last change, for delta sync (app/sync.py)")
 
     def __str__(self):
         return self.accountNumber
     
     class Meta:
         ordering = ['-accountNumber']
+        indexes = [
+            models.Index(fields=['creator', 'updatedAt'], name='account_creator_updated_idx'),
+        ]
 
-    def validate_and_format(self, account_number):
+    @staticmethod
+    def validate_and_format(account_number):
         pattern = r'^[a-z]{3}-h\d+$'
         if regex.fullmatch(pattern, account_number, regex.IGNORECASE):
             return account_number.upper()
         return None
         
     def save(self, *args, **kwargs):
-        oldAccount = Account.objects.filter(pk=self.pk).first()
-        if oldAccount:
-            if oldAccount.accountNumber != self.accountNumber:
+        if not self._state.adding:
+            if self.previous('accountNumber') != self.accountNumber:
                 raise ValueError("Cannot change account number after creation!")
         
         else: # Creating new account
@@ -210,3 +400,195 @@ class Account(models.Model):
                 self.contract.save(update_fields=['uid'])
         super().save(*args, **kwargs)
 
+
+
+
+class AccountSummary(models.Model):
+    """ Denormalized home list row of an account, kept in sync by app/signals.py """
+    account = models.OneToOneField(Account, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='accountSummaries')
+
+    name = models.CharField(max_length=100)
+    phone = models.CharField(max_length=14)
+    avatar = models.CharField(max_length=255, blank=True, help_text="Storage name of the customer avatar")
+    cashBalance = models.IntegerField(default=0)
+    isActive = models.BooleanField(default=True)
+
+    SYNC_FIELDS = ['creator', 'name', 'phone', 'avatar', 'cashBalance', 'isActive']
+
+    def __str__(self):
+        return self.account_id
+
+    class Meta:
+        ordering = ['-account_id']
+        indexes = [
+            models.Index(fields=['creator', '-account'], name='summary_creator_account_idx'),
+            models.Index(fields=['creator', 'isActive', '-account'], name='summary_creator_active_idx'),
+        ]
+
+    @classmethod
+    def fromAccount(cls, account):
+        customer = account.customer
+        contract = account.contract
+        return cls(
+            account_id=account.accountNumber,
+            creator_id=account.creator_id,
+            name=customer.name if customer else "Unknown",
+            phone=customer.phone if customer else "N/A",
+            avatar=customer.avatar.name if customer and customer.avatar else '',
+            cashBalance=contract.cashBalance if contract else 0,
+            isActive=account.isActive,
+        )
+
+    @classmethod
+    def sync(cls, accounts):
+        """ Insert or refresh the summaries of the given accounts in one query. """
+        summaries = [cls.fromAccount(account) for account in accounts]
+        if summaries:
+            cls.objects.bulk_create(
+                summaries, update_conflicts=True,
+                unique_fields=['account'], update_fields=cls.SYNC_FIELDS
+            )
+        return len(summaries)
+
+
+
+class ShopStats(models.Model):
+    """
+    Dashboard totals of one user (shop), adjusted in O(1) by app/signals.py and
+    rebuilt from scratch by `manage.py reconcile_shop_stats`.
+    collectionsToday belongs to `day` and the monthly counters to `month`; they
+    restart from zero on the first write of a new day or month.
+    """
+    creator = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shopStats')
+
+    outstandingCash = models.BigIntegerField(default=0, help_text="Cash balance of all active accounts")
+    activeAccounts = models.PositiveIntegerField(default=0)
+    closedAccounts = models.PositiveIntegerField(default=0)
+
+    day = models.DateField(null=True)
+    collectionsToday = models.BigIntegerField(default=0)
+    month = models.DateField(null=True, help_text="First day of the month of the monthly counters")
+    collectionsMonth = models.BigIntegerField(default=0)
+    newSalesMonth = models.PositiveIntegerField(default=0)
+
+    reconciledAt = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'Stats: {self.creator}'
+
+    @staticmethod
+    def period(today=None):
+        today = today or timezone.localdate()
+        return today, today.replace(day=1)
+
+    def asDict(self):
+        today, month = self.period()
+        sameDay, sameMonth = self.day == today, self.month == month
+        return {
+            'outstandingCash': self.outstandingCash,
+            'activeAccounts': self.activeAccounts,
+            'closedAccounts': self.closedAccounts,
+            'collectionsToday': self.collectionsToday if sameDay else 0,
+            'collectionsMonth': self.collectionsMonth if sameMonth else 0,
+            'newSalesMonth': self.newSalesMonth if sameMonth else 0,
+        }
+
+    @classmethod
+    def adjust(cls, creator_id=None, contract_id=None, outstanding=0, active=0, closed=0,
+            collected=0, collectedOn=None, newSales=0, saleDate=None, create=True):
+        """
+        Apply signed deltas to the totals of a shop, given by user or by one of its
+        contracts, with one UPDATE. The first change of a shop without a row builds
+        it with reconcile() instead, unless `create` is False.
+        """
+        today, month = cls.period()
+        F, Case, When, Value = models.F, models.Case, models.When, models.Value
+
+        todayAmount = collected if collectedOn == today else 0
+        monthAmount = collected if collectedOn and collectedOn.replace(day=1) == month else 0
+        monthSales = newSales if saleDate and saleDate.replace(day=1) == month else 0
+
+        if creator_id is not None:
+            stats = cls.objects.filter(creator_id=creator_id)
+        else:
+            stats = cls.objects.filter(creator__accounts__contract_id=contract_id)
+
+        updated = stats.update(
+            outstandingCash=F('outstandingCash') + outstanding,
+            activeAccounts=F('activeAccounts') + active,
+            closedAccounts=F('closedAccounts') + closed,
+            collectionsToday=Case(When(day=today, then=F('collectionsToday') + todayAmount), default=Value(todayAmount)),
+            day=today,
+            collectionsMonth=Case(When(month=month, then=F('collectionsMonth') + monthAmount), default=Value(monthAmount)),
+            newSalesMonth=Case(When(month=month, then=F('newSalesMonth') + monthSales), default=Value(monthSales)),
+            month=month,
+        )
+
+        if not updated and create:
+            if creator_id is None:
+                creator_id = Account.objects.filter(contract_id=contract_id).values_list('creator_id', flat=True).first()
+            if creator_id is not None:
+                cls.reconcile([creator_id])
+
+    @classmethod
+    def contractChanged(cls, contract_id, balanceDelta, collected=0, collectedOn=None):
+        """ A contract's cash balance moved by `balanceDelta`, `collected` was paid on `collectedOn`. """
+        isActive = models.Exists(Account.objects.filter(contract_id=contract_id, isActive=True))
+        outstanding = models.Case(models.When(isActive, then=models.Value(balanceDelta)), default=models.Value(0))
+        cls.adjust(contract_id=contract_id, outstanding=outstanding, collected=collected, collectedOn=collectedOn)
+
+    @classmethod
+    def reconcile(cls, creators=None):
+        """ Recompute the totals of the given users (all when None) from Account and Payment. """
+        today, month = cls.period()
+        Count, Sum, Q = models.Count, models.Sum, models.Q
+
+        users = User.objects.all() if creators is None else User.objects.filter(pk__in=creators)
+        accounts = (Account.objects.filter(creator__in=users).order_by().values('creator')
+            .annotate(
+                active=Count('pk', filter=Q(isActive=True)),
+                closed=Count('pk', filter=Q(isActive=False)),
+                outstanding=Sum('contract__cashBalance', filter=Q(isActive=True)),
+                newSales=Count('pk', filter=Q(saleDate__gte=month, saleDate__lte=today)),
+            ))
+        collections = (Payment.objects.filter(contract__account__creator__in=users, date__gte=month, date__lte=today)
+            .order_by().values('contract__account__creator')
+            .annotate(month=Sum('amount'), today=Sum('amount', filter=Q(date=today))))
+
+        stats = {pk: cls(creator_id=pk, day=today, month=month, reconciledAt=timezone.now())
+            for pk in users.values_list('pk', flat=True)}
+        for row in accounts:
+            shop = stats[row['creator']]
+            shop.activeAccounts, shop.closedAccounts = row['active'], row['closed']
+            shop.outstandingCash, shop.newSalesMonth = row['outstanding'] or 0, row['newSales']
+        for row in collections:
+            shop = stats[row['contract__account__creator']]
+            shop.collectionsMonth, shop.collectionsToday = row['month'] or 0, row['today'] or 0
+
+        cls.objects.bulk_create(stats.values(), update_conflicts=True, unique_fields=['creator'],
+            update_fields=['outstandingCash', 'activeAccounts', 'closedAccounts', 'day', 'collectionsToday',
+                'month', 'collectionsMonth', 'newSalesMonth', 'reconciledAt'])
+        return len(stats)
+
+
+
+class Tombstone(models.Model):
+    """
+    A deleted row of a delta sync stream (app/sync.py), so offline clients drop it too.
+    Kept for SYNC_TOMBSTONE_DAYS, see `manage.py prune_tombstones`.
+    """
+    creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    stream = models.CharField(max_length=20, help_text="Sync stream of the deleted row: customers, accounts, ...")
+    key = models.CharField(max_length=100, help_text="Primary key of the deleted row")
+    deletedAt = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.stream}: {self.key}'
+
+    class Meta:
+        ordering = ['-deletedAt']
+        indexes = [
+            models.Index(fields=['creator', 'deletedAt'], name='tombstone_creator_deleted_idx'),
+            models.Index(fields=['stream', 'key'], name='tombstone_stream_key_idx'),
+        ]
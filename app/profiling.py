@@ -0,0 +1,212 @@
+import heapq
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+
+logger = logging.getLogger('app.profiling')
+
+# Profile of the request being handled, None when it isn't sampled
+currentProfile = ContextVar('currentProfile', default=None)
+
+# execute_wrapper hooks watching the queries of the request being handled. Kept in a
+# contextvar rather than passed to connection.execute_wrapper(): under ASGI the async ORM
+# queries on the connection of another thread, and only contextvars follow it there.
+queryHooks = ContextVar('queryHooks', default=())
+
+
+def runQueryHooks(execute, sql, params, many, context):
+    for hook in reversed(queryHooks.get()):
+        execute = partial(hook, execute)
+    return execute(sql, params, many, context)
+
+
+def installQueryHooks(sender, connection, **kwargs):
+    """ connection_created: every connection runs the hooks of the current request. """
+    if runQueryHooks not in connection.execute_wrappers:
+        connection.execute_wrappers.append(runQueryHooks)
+
+
+connection_created.connect(installQueryHooks)
+
+
+@contextmanager
+def watchQueries(hook):
+    """ Call `hook`, an execute_wrapper, around the queries run in the block, whatever their thread. """
+    for connection in connections.all(initialized_only=True):  # Opened before this module was loaded
+        installQueryHooks(None, connection)
+    token = queryHooks.set(queryHooks.get() + (hook,))
+    try:
+        yield
+    finally:
+        queryHooks.reset(token)
+
+
+class Profile:
+    """ Timings of one request; only the slowest statements are kept, whatever the query count. """
+
+    def __init__(self, topSql):
+        self.started = time.perf_counter()
+        self.timings = {}  # name -> ms
+        self.queries = 0
+        self.dbTime = 0.0
+        self.topSql = topSql
+        self.slowest = []  # min-heap of (ms, sql)
+
+    def record(self, name, ms):
+        self.timings[name] = self.timings.get(name, 0.0) + ms
+
+    def recordQuery(self, sql, ms):
+        self.queries += 1
+        self.dbTime += ms
+        if len(self.slowest) < self.topSql:
+            heapq.heappush(self.slowest, (ms, sql))
+        elif ms > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (ms, sql))
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.recordQuery(sql, (time.perf_counter() - started) * 1000)
+
+    @property
+    def total(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def serverTiming(self, total):
+        metrics = [f'total;dur={total:.1f}', f'db;dur={self.dbTime:.1f};desc="{self.queries} queries"']
+        metrics += [f'{name};dur={ms:.1f}' for name, ms in self.timings.items()]
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(name):
+    """ Add the time spent in the block to `name` of the current profile, if any. """
+    profile = currentProfile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record(name, (time.perf_counter() - started) * 1000)
+
+
+def profiled(name):
+    """ Decorator version of timed(). """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('tpl'):
+            return super().render(context, request)
+
+
+class ProfilingTemplates(DjangoTemplates):
+    """ DjangoTemplates whose renders are timed as 'tpl'; set as the BACKEND in settings.TEMPLATES. """
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a PROFILING_SAMPLE_RATE share of the requests: total, DB (query count and
+    time) and template time, plus whatever code wraps itself in timed()/profiled().
+    They're sent back in a Server-Timing header, and requests slower than
+    SLOW_REQUEST_MS are logged to 'app.profiling' as JSON with their slowest SQL.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sampleRate = getattr(settings, 'PROFILING_SAMPLE_RATE', 1.0)
+        self.slowRequest = getattr(settings, 'SLOW_REQUEST_MS', 1000)
+        self.topSql = getattr(settings, 'PROFILING_TOP_SQL', 5)
+        self.isAsync = iscoroutinefunction(get_response)
+        if self.isAsync:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.isAsync:
+            return self.__acall__(request)
+        profile = Profile(self.topSql)
+        sampled = random.random() < self.sampleRate
+        with self.profiling(profile, sampled):
+            response = self.get_response(request)
+        total = profile.total
+        return self.finish(request, response, profile, sampled, total, getattr(request, 'user', None))
+
+    async def __acall__(self, request):
+        profile = Profile(self.topSql)
+        sampled = random.random() < self.sampleRate
+        with self.profiling(profile, sampled):
+            response = await self.get_response(request)
+        total = profile.total
+        user = None
+        if total >= self.slowRequest and hasattr(request, 'auser'):
+            user = await request.auser()  # The lazy request.user would query inside the event loop
+        return self.finish(request, response, profile, sampled, total, user)
+
+    @contextmanager
+    def profiling(self, profile, sampled):
+        if not sampled:  # Only the total time, so slow requests are still logged
+            yield
+            return
+        token = currentProfile.set(profile)
+        try:
+            with watchQueries(profile):
+                yield
+        finally:
+            currentProfile.reset(token)
+
+    def finish(self, request, response, profile, sampled, total, user):
+        if sampled:
+            response['Server-Timing'] = profile.serverTiming(total)
+        if total >= self.slowRequest:
+            self.logSlowRequest(request, response, total, user, profile if sampled else None)
+        return response
+
+    def logSlowRequest(self, request, response, total, user, profile=None):
+        entry = {
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user': user.pk if user is not None and user.is_authenticated else None,
+            'total_ms': round(total, 1),
+            'sampled': profile is not None,
+        }
+        if profile is not None:
+            entry.update({
+                'db_ms': round(profile.dbTime, 1),
+                'queries': profile.queries,
+                'timings_ms': {name: round(ms, 1) for name, ms in profile.timings.items()},
+                'slowest_sql': [{'ms': round(ms, 1), 'sql': sql[:1000]} for ms, sql in sorted(profile.slowest, reverse=True)],
+            })
+        logger.warning(json.dumps(entry))
@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import dataCache
+
+
+REPLICA = 'replica'
+
+# Whether the code running now may read from the replica (see readsFromReplica)
+replicaReads = ContextVar('replicaReads', default=False)
+
+
+def replicaConfigured():
+    return REPLICA in settings.DATABASES
+
+
+class ReplicaRouter:
+    """
+    Reads inside readsFromReplica() go to the replica, everything else, and every
+    write, to the primary. Installed when REPLICA_DATABASE_URL is set.
+    """
+
+    def db_for_read(self, model, **hints):
+        return REPLICA if replicaReads.get() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or rows read from the replica would be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Same data on both
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA  # Migrated through replication
+
+
+@contextmanager
+def readsFromReplica():
+    token = replicaReads.set(replicaConfigured())
+    try:
+        yield
+    finally:
+        replicaReads.reset(token)
+
+
+# ++++++++++++++++ READ-YOUR-WRITES PINNING +++++++++++++++++++
+
+def pinKey(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def pinToPrimary(user_id):
+    """ Read this user's data from the primary for REPLICA_PIN_SECONDS, longer than the replica lags. """
+    dataCache().set(pinKey(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def isPinned(user_id):
+    return bool(dataCache().get(pinKey(user_id)))
+
+
+_END = object()
+
+
+def _streamFromReplica(chunks):
+    # A streaming response runs its queries after the view returned, chunk by chunk
+    iterator = iter(chunks)
+    while True:
+        with readsFromReplica():
+            chunk = next(iterator, _END)
+        if chunk is _END:
+            return
+        yield chunk
+
+
+def replicaView(view):
+    """
+    Let a read-only view read from the replica, unless its user wrote recently
+    (see ReplicaPinMiddleware). Goes below login_required.
+    """
+    def finish(response):
+        if response.streaming and not response.is_async:
+            response.streaming_content = _streamFromReplica(response.streaming_content)
+        return response
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def asyncWrapper(request, *args, **kwargs):
+            user = await request.auser()
+            if not replicaConfigured() or await sync_to_async(isPinned)(user.pk):
+                return await view(request, *args, **kwargs)
+            with readsFromReplica():
+                return finish(await view(request, *args, **kwargs))
+        return asyncWrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replicaConfigured() or isPinned(request.user.pk):
+            return view(request, *args, **kwargs)
+        with readsFromReplica():
+            return finish(view(request, *args, **kwargs))
+    return wrapper
+
+
+class ReplicaPinMiddleware:
+    """ After a logged in user's POST (or other unsafe request), pin their reads to the primary. """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicaConfigured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.isAsync = iscoroutinefunction(get_response)
+        if self.isAsync:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.isAsync:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.pin(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        await sync_to_async(self.pin)(request)
+        return response
+
+    def pin(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return
+        # The user id from the session: request.user may not be loaded (async views use auser())
+        user_id = request.session.get(SESSION_KEY)
+        if user_id is not None:
+            pinToPrimary(get_user_model()._meta.pk.to_python(user_id))
@@ -0,0 +1,190 @@
+import re
+import warnings
+
+from django.db import DatabaseError, connections, router, transaction
+from django.db import models
+from django.db.models.functions import Greatest
+
+from .models import Account, AccountSummary, Customer, Guarantor
+
+
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_MIN_LENGTH = 2
+
+# pg_trgm thresholds for a match; low enough to catch misspelled romanized names
+SEARCH_SIMILARITY = 0.3
+SEARCH_WORD_SIMILARITY = 0.3
+
+# (model, field) pairs with a trigram GIN index on PostgreSQL
+TRIGRAM_INDEXES = [
+    (Customer, 'name'),
+    (Customer, 'address'),
+    (Guarantor, 'name'),
+    (Account, 'accountNumber'),
+]
+
+# A customer found by address ranks below one found by name
+ADDRESS_WEIGHT = 0.8
+
+# Account filter of a status query param; other values search all accounts
+STATUS_FILTERS = {
+    'active': {'isActive': True},
+    'closed': {'isActive': False},
+}
+
+
+def createTrigramIndexes(using='default', **kwargs):
+    """ post_migrate: enable pg_trgm and create the GIN indexes of TRIGRAM_INDEXES. """
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+
+    quote = db.ops.quote_name
+    try:
+        with db.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for model, field in TRIGRAM_INDEXES:
+                table = model._meta.db_table
+                column = model._meta.get_field(field).column
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {quote(f"{table}_{column}_trgm"[:63])} '
+                    f'ON {quote(table)} USING gin ({quote(column)} gin_trgm_ops)'
+                )
+    except DatabaseError as e:  # e.g. no permission to create the extension
+        warnings.warn(f'Trigram search indexes not created, search will be slow: {e}')
+
+
+def searchAccounts(user, query, limit=SEARCH_LIMIT, status='all'):
+    """
+    Accounts of `user` ranked by how well `query` matches their account number, their
+    customer's name or address, or one of their guarantors' names. Fuzzy: a few wrong
+    letters still match. `status` (active, closed or all) filters the accounts before
+    they are ranked. Returns (AccountSummary, score, matched field) tuples.
+    """
+    query = query.strip()
+    if len(query) < SEARCH_MIN_LENGTH:
+        return []
+
+    accounts = Account.objects.filter(creator=user, **STATUS_FILTERS.get(status, {}))
+    if connections[router.db_for_read(Account)].vendor == 'postgresql':
+        scores = _trigramScores(user, accounts, query, limit, status in STATUS_FILTERS)
+    else:
+        scores = _fallbackScores(user, accounts, query)
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+    summaries = AccountSummary.objects.in_bulk([pk for pk, _ in ranked])
+    return [(summaries[pk], score, matched) for pk, (score, matched) in ranked if pk in summaries]
+
+
+def _addScores(scores, rows, matched):
+    # rows: (accountNumber, score); keeps the best score of every account
+    for pk, score in rows:
+        if pk not in scores or score > scores[pk][0]:
+            scores[pk] = (round(score, 3), matched)
+
+
+def _accountsOf(accounts, candidates, relation):
+    # candidates: {uid: score} of customers or guarantors -> [(accountNumber, score)]
+    accounts = accounts.filter(**{f'{relation}__in': list(candidates)}).values_list('pk', relation)
+    return [(pk, candidates[uid]) for pk, uid in accounts]
+
+
+# ++++++++++++++++ POSTGRESQL (pg_trgm) +++++++++++++++++++
+
+def _trigramScores(user, accounts, query, limit, filtered):
+    from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+
+    scores = {}
+    using = router.db_for_read(Account)
+    with transaction.atomic(using=using):
+        with connections[using].cursor() as cursor:  # % and %> use these thresholds, and the GIN indexes
+            cursor.execute('SELECT set_config(%s, %s, true), set_config(%s, %s, true)', [
+                'pg_trgm.similarity_threshold', str(SEARCH_SIMILARITY),
+                'pg_trgm.word_similarity_threshold', str(SEARCH_WORD_SIMILARITY),
+            ])
+
+        # With a status filter, only people with such an account take up one of the `limit` places
+        customers = Customer.objects.filter(creator=user)
+        guarantors = Guarantor.objects.filter(creator=user)
+        if filtered:
+            customers = customers.filter(models.Exists(accounts.filter(customer=models.OuterRef('pk'))))
+            guarantors = guarantors.filter(models.Exists(accounts.filter(guarantors=models.OuterRef('pk'))))
+
+        # % alone, so the GIN index answers the whole WHERE; a substring only ranks what it found higher
+        matches = (accounts
+            .filter(accountNumber__trigram_similar=query)
+            .annotate(score=Greatest(
+                TrigramSimilarity('accountNumber', query),
+                models.Case(models.When(accountNumber__icontains=query, then=models.Value(0.9)), default=models.Value(0.0)),
+            ))
+            .order_by('-score').values_list('pk', 'score')[:limit])
+        _addScores(scores, matches, 'account')
+
+        customers = (customers
+            .filter(models.Q(name__trigram_word_similar=query) | models.Q(address__trigram_word_similar=query))
+            .annotate(score=Greatest(
+                TrigramWordSimilarity(query, 'name'),
+                TrigramWordSimilarity(query, 'address') * ADDRESS_WEIGHT,
+            ))
+            .order_by('-score').values_list('uid', 'score')[:limit])
+        _addScores(scores, _accountsOf(accounts, dict(customers), 'customer'), 'customer')
+
+        guarantors = (guarantors.filter(name__trigram_word_similar=query)
+            .annotate(score=TrigramWordSimilarity(query, 'name'))
+            .order_by('-score').values_list('uid', 'score')[:limit])
+        _addScores(scores, _accountsOf(accounts, dict(guarantors), 'guarantors'), 'guarantor')
+    return scores
+
+
+# ++++++++++++++++ PORTABLE FALLBACK (SQLite) +++++++++++++++++++
+# Scans the user's rows in Python with the pg_trgm formulas, fine for tests and small shops.
+
+def trigrams(text):
+    """ pg_trgm's trigrams: lowercase alphanumeric words padded with two spaces in front, one behind. """
+    result = set()
+    for word in re.findall(r'\w+', text.lower()):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a, b):
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+
+def wordSimilarity(query, text):
+    """ Best similarity of `query` with any run of consecutive words of `text`. """
+    words = re.findall(r'\w+', text or '')
+    best = 0.0
+    for start in range(len(words)):
+        for end in range(start + 1, min(start + 4, len(words)) + 1):
+            best = max(best, similarity(query, ' '.join(words[start:end])))
+    return best
+
+
+def _fallbackScores(user, accounts, query):
+    scores = {}
+
+    matches = []
+    for pk in accounts.values_list('pk', flat=True).iterator():
+        score = max(similarity(query, pk), 0.9 if query.lower() in pk.lower() else 0.0)
+        if score >= SEARCH_SIMILARITY:
+            matches.append((pk, score))
+    _addScores(scores, matches, 'account')
+
+    customers = {}
+    for uid, name, address in Customer.objects.filter(creator=user).values_list('uid', 'name', 'address').iterator():
+        nameScore, addressScore = wordSimilarity(query, name), wordSimilarity(query, address)
+        if max(nameScore, addressScore) >= SEARCH_WORD_SIMILARITY:
+            customers[uid] = max(nameScore, addressScore * ADDRESS_WEIGHT)
+    _addScores(scores, _accountsOf(accounts, customers, 'customer'), 'customer')
+
+    guarantors = {}
+    for uid, name in Guarantor.objects.filter(creator=user).values_list('uid', 'name').iterator():
+        score = wordSimilarity(query, name)
+        if score >= SEARCH_WORD_SIMILARITY:
+            guarantors[uid] = score
+    _addScores(scores, _accountsOf(accounts, guarantors, 'guarantors'), 'guarantor')
+    return scores
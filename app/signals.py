@@ -1,52 +1,277 @@
 from django.db import transaction
+from django.core.exceptions import ValidationError
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, post_save, post_delete
-from .models import Payment, Account
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
+from .models import Payment, Account, AccountSummary, Customer, Guarantor, Product, Contract, ShopStats
+from .caching import bumpAccountVersions, bumpUserDataVersion, bumpProductVersion
+from .sync import forgetDeleted, recordDeleted
+from . import metrics
 
 # Signal handler for when a Payment is about to be saved (pre_save)
 @receiver(pre_save, sender=Payment)
 def store_old_payment_amount(sender, instance, **kwargs):
     # Only process updates, not new payments
     if not instance._state.adding:
-        old_instance = Payment.objects.get(pk=instance.pk)
-        instance._old_amount = old_instance.amount
+        old = (instance.previous('amount'), instance.previous('contract'), instance.previous('date'))
+        if None in old:  # Instance was not loaded from the database with these fields
+            old = Payment.objects.values_list('amount', 'contract_id', 'date').get(pk=instance.pk)
+        instance._old_amount, instance._old_contract, instance._old_date = old
     else:
-        instance._old_amount = 0
+        instance._old_amount, instance._old_contract, instance._old_date = 0, None, None
+
+
+def apply_payment_to_contract(instance, amount, contract_id=None):
+    """
+    Atomically move `amount` into the paid total of the payment's contract (or of
+    `contract_id`, the one it was moved away from) and refresh its summary row.
+    """
+    if not amount:
+        return
+
+    if contract_id is None:
+        contract_id = instance.contract_id
+        contract = instance.contract if Payment.contract.is_cached(instance) else None
+    else:
+        contract = None
+    row = Contract.applyPayment(contract_id, amount, contract)
+    if row is None:
+        if amount > 0:
+            raise ValidationError("Payment amount exceeds remaining balance.")
+        return  # Contract itself is being deleted
+    AccountSummary.objects.filter(account__contract_id=contract_id).update(cashBalance=row[1])
+
 
 # Signal handler for when a Payment is saved (post_save)
 @receiver(post_save, sender=Payment)
 def update_contract_on_payment_create_or_update(sender, instance, created, **kwargs):
-    with transaction.atomic():
-        contract = instance.contract
-        payment_amount = instance.amount
-        old_payment_amount = instance._old_amount
-
-        if created:
-            # Handle creation: Subtract the new amount
-            contract.cashBalance -= payment_amount
-            contract.hireBalance -= payment_amount
-        
-        # Handle update: Reverse the old amount and apply the new amount
-        elif old_payment_amount != payment_amount:
-            net_difference = old_payment_amount - payment_amount
-            contract.cashBalance += net_difference
-            contract.hireBalance += net_difference
-        contract.save()
+    old_amount, old_contract, old_date = instance._old_amount, instance._old_contract, instance._old_date
+    if created:
+        transaction.on_commit(lambda: metrics.inc('cms_payments_posted_total', source='single'))
+
+    if not created and old_contract != instance.contract_id:
+        # Moved to another contract: reverse it on the old one, apply all of it to the new one
+        apply_payment_to_contract(instance, -old_amount, contract_id=old_contract)
+        apply_payment_to_contract(instance, instance.amount)
+        ShopStats.contractChanged(old_contract, old_amount, collected=-old_amount, collectedOn=old_date)
+        ShopStats.contractChanged(instance.contract_id, -instance.amount, collected=instance.amount, collectedOn=instance.date)
+        bump_account_versions(contract_id=old_contract)
+        return
+
+    # Handle creation: apply the new amount
+    # Handle update: apply only the difference to the old amount
+    apply_payment_to_contract(instance, instance.amount - old_amount)
+
+    # Dashboard totals: collections are counted on the payment date
+    if created or old_date == instance.date:
+        if created or instance.amount != old_amount:
+            net = instance.amount - old_amount
+            ShopStats.contractChanged(instance.contract_id, -net, collected=net, collectedOn=instance.date)
+    else:
+        ShopStats.contractChanged(instance.contract_id, old_amount, collected=-old_amount, collectedOn=old_date)
+        ShopStats.contractChanged(instance.contract_id, -instance.amount, collected=instance.amount, collectedOn=instance.date)
 
 
 # Signal handler for when a Payment is deleted
 @receiver(post_delete, sender=Payment)
 def update_contract_on_payment_delete(sender, instance, **kwargs):
-    contract = instance.contract
     with transaction.atomic():
-        contract.cashBalance += instance.amount
-        contract.hireBalance += instance.amount
-        contract.save()
+        apply_payment_to_contract(instance, -instance.amount)
+        ShopStats.contractChanged(instance.contract_id, instance.amount, collected=-instance.amount, collectedOn=instance.date)
 
 
 # Signal handler for when a Account is deleted
 @receiver(post_delete, sender=Account)
 def delete_related_models_when_account_deleted(sender, instance, **kwargs):
     contract = getattr(instance, 'contract', None)
+    ShopStats.adjust(
+        instance.creator_id,
+        outstanding=-contract.cashBalance if contract and instance.isActive else 0,
+        active=-1 if instance.isActive else 0,
+        closed=0 if instance.isActive else -1,
+        newSales=-1, saleDate=instance.saleDate,
+        create=False,  # The whole user may be getting deleted
+    )
+    # Collections of its payments are removed by the next reconcile
     if contract:
         contract.delete()
+
+
+
+# Keep the home list read model (AccountSummary) in sync
+# update_fields holds only the changed fields (TrackedFieldsMixin), skip unrelated saves
+def touches(update_fields, fields):
+    return update_fields is None or bool(set(update_fields) & set(fields))
+
+
+@receiver(post_save, sender=Account)
+def sync_summary_on_account_save(sender, instance, update_fields=None, **kwargs):
+    if touches(update_fields, ['creator', 'customer', 'contract', 'isActive']):
+        AccountSummary.sync([instance])
+
+
+@receiver(post_save, sender=Customer)
+def sync_summary_on_customer_save(sender, instance, created, update_fields=None, **kwargs):
+    if created or not touches(update_fields, ['name', 'phone', 'avatar']):
+        return  # A new customer has no accounts yet
+    AccountSummary.objects.filter(account__customer_id=instance.pk).update(
+        name=instance.name,
+        phone=instance.phone,
+        avatar=instance.avatar.name if instance.avatar else '',
+    )
+
+
+@receiver(post_save, sender=Contract)
+def sync_summary_on_contract_save(sender, instance, created, update_fields=None, **kwargs):
+    if created or not touches(update_fields, ['cashBalance']):
+        return  # Linked to its account afterwards, which syncs the summary
+    AccountSummary.objects.filter(account__contract_id=instance.pk).update(cashBalance=instance.cashBalance)
+
+
+@receiver(post_delete, sender=Contract)
+def sync_summary_on_contract_delete(sender, instance, **kwargs):
+    AccountSummary.objects.filter(account__contract_id=instance.pk).update(cashBalance=0)
+
+
+
+# Keep the dashboard totals (ShopStats) in sync
+@receiver(post_save, sender=Account)
+def update_shop_stats_on_account_save(sender, instance, created, update_fields=None, **kwargs):
+    contract = instance.contract if instance.contract_id else None
+    outstanding = contract.cashBalance if contract and instance.isActive else 0
+
+    if created:
+        ShopStats.adjust(
+            instance.creator_id, outstanding=outstanding,
+            active=1 if instance.isActive else 0, closed=0 if instance.isActive else 1,
+            newSales=1, saleDate=models.DateField().to_python(instance.saleDate),
+        )
+        return
+
+    if not touches(update_fields, ['isActive', 'contract']):
+        return
+
+    wasActive = instance.previous('isActive')
+    oldContract = instance.previous('contract')
+    if wasActive is None:
+        return  # Not loaded from the database, nothing to compare with
+
+    if not oldContract or not wasActive:
+        oldOutstanding = 0
+    elif oldContract == instance.contract_id:
+        oldOutstanding = contract.cashBalance
+    else:
+        oldOutstanding = Contract.objects.filter(pk=oldContract).values_list('cashBalance', flat=True).first() or 0
+
+    activeDelta = int(instance.isActive) - int(wasActive)
+    ShopStats.adjust(instance.creator_id, outstanding=outstanding - oldOutstanding, active=activeDelta, closed=-activeDelta)
+
+
+@receiver(post_save, sender=Contract)
+def update_shop_stats_on_contract_save(sender, instance, created, update_fields=None, **kwargs):
+    previous = instance.previous('cashBalance')
+    if created or previous is None or not touches(update_fields, ['cashBalance']):
+        return
+    if instance.cashBalance != previous:
+        ShopStats.contractChanged(instance.pk, instance.cashBalance - previous)
+
+
+# Versions of the account creation form data (customers, guarantors, products),
+# bumped once the change is committed so clients never see a version without its rows
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Guarantor)
+def bump_data_version_on_save(sender, instance, created, **kwargs):
+    creator_id = instance.creator_id
+    transaction.on_commit(lambda: bumpUserDataVersion(creator_id))
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Guarantor)
+def bump_data_version_on_delete(sender, instance, **kwargs):
+    creator_id = instance.creator_id
+    transaction.on_commit(lambda: bumpUserDataVersion(creator_id, deleted=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_version(sender, instance, **kwargs):
+    transaction.on_commit(bumpProductVersion)
+
+
+# Versions behind the ETag of the accounts list and account pages
+def bump_account_versions(**filters):
+    transaction.on_commit(lambda: bumpAccountVersions(Account.objects.filter(**filters).values_list('pk', 'creator_id')))
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def bump_account_version(sender, instance, **kwargs):
+    accounts = [(instance.pk, instance.creator_id)]
+    transaction.on_commit(lambda: bumpAccountVersions(accounts))
+
+
+@receiver(post_save, sender=Contract)
+def bump_account_version_on_contract_save(sender, instance, created, **kwargs):
+    if not created:  # A new contract isn't linked to its account yet
+        bump_account_versions(contract_id=instance.pk)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def bump_account_version_on_payment(sender, instance, **kwargs):
+    bump_account_versions(contract_id=instance.contract_id)
+
+
+@receiver(post_save, sender=Customer)
+def bump_account_versions_on_customer_save(sender, instance, created, **kwargs):
+    if not created:
+        bump_account_versions(customer_id=instance.pk)
+
+
+@receiver(post_save, sender=Guarantor)
+def bump_account_versions_on_guarantor_save(sender, instance, created, **kwargs):
+    if not created:
+        bump_account_versions(guarantors=instance.pk)
+
+
+
+# Tombstones for delta sync (app/sync.py); nothing is recorded when the whole user goes.
+# Clients drop the contract and payments of a deleted account themselves, so those
+# are only recorded when deleted on their own.
+def deleted_model(origin):
+    return origin.model if isinstance(origin, models.QuerySet) else type(origin)
+
+
+@receiver(pre_delete, sender=Customer)
+@receiver(pre_delete, sender=Guarantor)
+@receiver(pre_delete, sender=Account)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    if instance.creator_id is not None and not isinstance(origin, User):
+        recordDeleted(sender, instance.pk, instance.creator_id)
+
+
+@receiver(pre_delete, sender=Contract)
+@receiver(pre_delete, sender=Payment)
+def record_contract_tombstone(sender, instance, origin=None, **kwargs):
+    if deleted_model(origin) is not sender:
+        return
+    contract_id = instance.pk if sender is Contract else instance.contract_id
+    creator_id = Account.objects.filter(contract_id=contract_id).values_list('creator_id', flat=True).first()
+    if creator_id is not None:  # None for the contract of an account being deleted
+        recordDeleted(sender, instance.pk, creator_id)
+
+
+@receiver(pre_delete, sender=Guarantor)
+def touch_accounts_on_guarantor_delete(sender, instance, origin=None, **kwargs):
+    # Their guarantors column changes with the m2m rows deleted along
+    if not isinstance(origin, User):
+        Account.objects.filter(guarantors=instance).update(updatedAt=timezone.now())
+
+
+@receiver(post_save, sender=Account)
+def forget_tombstone_on_account_create(sender, instance, created, **kwargs):
+    if created:  # The number of a deleted account was reused
+        forgetDeleted(Account, [instance.pk])
+
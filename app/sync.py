@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.db import models
+from django.utils import timezone
+
+from .models import Account, Contract, Customer, Guarantor, Payment, Tombstone
+
+
+SYNC_BATCH_SIZE = 500
+SYNC_MAX_BATCH_SIZE = 2000
+CURSOR_SALT = 'app.sync'
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Stream:
+    """
+    Rows of one model owned by a user, in (time, pk) order. A position is the
+    (time, pk) of the last row sent while paging, or (time, None) once caught up.
+    """
+
+    def __init__(self, name, model, fields, owner, timeField='updatedAt'):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.owner = owner  # Lookup from the model to its user
+        self.timeField = timeField
+
+    def queryset(self, user):
+        return self.model.objects.filter(**{self.owner: user})
+
+    def changes(self, user, position, limit, overlap):
+        """ Up to `limit` rows after `position`: (rows, new position, whether more rows are left). """
+        rows = self.queryset(user).order_by(self.timeField, 'pk')
+        if position is not None:
+            time, pk = position
+            if pk is None:  # Caught up: look back `overlap` for rows of transactions that committed late
+                rows = rows.filter(**{f'{self.timeField}__gt': time - overlap})
+            else:
+                rows = rows.filter(models.Q(**{f'{self.timeField}__gt': time}) | models.Q(**{self.timeField: time, 'pk__gt': pk}))
+
+        page = list(rows.values_list(*self.fields, self.timeField, 'pk')[:limit + 1])
+        hasMore = len(page) > limit
+        page = page[:limit]
+        if page:
+            position = (page[-1][-2], page[-1][-1] if hasMore else None)
+        elif position is not None:
+            position = (position[0], None)
+        return self.serialize([row[:-2] for row in page]), position, hasMore
+
+    def columns(self):
+        return list(self.fields)
+
+    def serialize(self, rows):
+        return [list(row) for row in rows]
+
+
+class AccountStream(Stream):
+    """ Accounts, with the uids of their guarantors as the last column. """
+
+    def columns(self):
+        return [*self.fields, 'guarantors']
+
+    def serialize(self, rows):
+        guarantors = {}
+        if rows:
+            links = Account.guarantors.through.objects.filter(account_id__in=[row[0] for row in rows])
+            for account_id, guarantor_id in links.values_list('account_id', 'guarantor_id'):
+                guarantors.setdefault(account_id, []).append(guarantor_id)
+        return [[*row, guarantors.get(row[0], [])] for row in rows]
+
+
+PERSON_COLUMNS = ('uid', 'name', 'phone', 'address', 'occupation')
+
+# In the order clients apply them: parents before the rows pointing at them
+STREAMS = [
+    Stream('customers', Customer, PERSON_COLUMNS, 'creator'),
+    Stream('guarantors', Guarantor, PERSON_COLUMNS, 'creator'),
+    AccountStream('accounts', Account, ('accountNumber', 'customer', 'product', 'contract', 'saleDate', 'isActive', 'remarks'), 'creator'),
+    Stream('contracts', Contract, ('id', 'cashValue', 'hireValue', 'downPayment', 'monthlyPayment', 'length',
+        'paidTotal', 'cashBalance', 'hireBalance'), 'account__creator'),
+    Stream('payments', Payment, ('id', 'contract', 'date', 'receiptId', 'amount'), 'contract__account__creator'),
+]
+DELETED = Stream('deleted', Tombstone, ('stream', 'key'), 'creator', timeField='deletedAt')
+
+STREAMS_BY_MODEL = {stream.model: stream for stream in STREAMS}
+STREAMS_BY_NAME = {stream.name: stream for stream in STREAMS}
+
+
+# ++++++++++++++++ TOMBSTONES +++++++++++++++++++
+
+def recordDeleted(model, pk, creator_id):
+    Tombstone.objects.create(creator_id=creator_id, stream=STREAMS_BY_MODEL[model].name, key=str(pk))
+
+
+def forgetDeleted(model, pks):
+    """
+    Drop the tombstones of re-created keys (account numbers are typed in), or a
+    client catching up could apply the old delete after receiving the new row.
+    """
+    Tombstone.objects.filter(stream=STREAMS_BY_MODEL[model].name, key__in=[str(pk) for pk in pks]).delete()
+
+
+def pruneTombstones(days=None):
+    """ Delete the tombstones older than SYNC_TOMBSTONE_DAYS; clients offline longer get a full sync. """
+    days = days if days is not None else getattr(settings, 'SYNC_TOMBSTONE_DAYS', 90)
+    deleted, _ = Tombstone.objects.filter(deletedAt__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+# ++++++++++++++++ CURSOR +++++++++++++++++++
+
+def _micros(time):
+    return (time - EPOCH) // timedelta(microseconds=1)
+
+
+def _time(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def makeCursor(user_id, issued, positions):
+    return signing.dumps({
+        'u': user_id,
+        'at': _micros(issued),
+        'p': {name: [_micros(time), pk] for name, (time, pk) in positions.items()},
+    }, salt=CURSOR_SALT, compress=True)
+
+
+def parseCursor(cursor, user_id):
+    """ (issue time, {stream name: position}) of a cursor, raises ValueError if it isn't one of this user's. """
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+        if data['u'] != user_id:
+            raise ValueError('Invalid cursor.')
+        return _time(data['at']), {name: (_time(time), pk) for name, (time, pk) in data['p'].items()}
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise ValueError('Invalid cursor.')
+
+
+# ++++++++++++++++ SYNC +++++++++++++++++++
+
+def syncBatch(user, cursor=None, limit=SYNC_BATCH_SIZE):
+    """
+    Next batch of the rows of `user` changed since `cursor`, at most `limit` rows:
+
+        reset    True when the client must drop its copy first: no cursor, or one
+                 older than the tombstones (SYNC_TOMBSTONE_DAYS)
+        deleted  {stream: [pk, ...]}, to apply first. A deleted account takes its
+                 contract and payments along
+        changes  {stream: {fields: [...], rows: [[...], ...]}}, rows to insert or
+                 replace, in the order of the streams
+        more     True until the client has caught up; it keeps requesting with
+        cursor   the cursor of the previous batch, and stores the last one
+
+    Rows changed in the SYNC_OVERLAP_SECONDS before a caught up position are sent
+    again, so rows of transactions that committed after the previous sync aren't missed.
+    """
+    now = timezone.now()
+    positions = {}
+    if cursor:
+        issued, positions = parseCursor(cursor, user.pk)
+        if issued < now - timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_DAYS', 90)):
+            positions = {}  # Deletes since may have been pruned
+    reset = not positions
+    if reset:
+        positions[DELETED.name] = (now, None)  # An empty copy has nothing to delete
+    overlap = timedelta(seconds=getattr(settings, 'SYNC_OVERLAP_SECONDS', 60))
+
+    deleted, changes, more = {}, {}, False
+    budget = limit
+    for stream in [DELETED, *STREAMS]:
+        if not budget:
+            more = True
+            continue
+        rows, position, hasMore = stream.changes(user, positions.get(stream.name), budget, overlap)
+        if position is not None:
+            positions[stream.name] = position
+        more = more or hasMore
+        budget -= len(rows)
+
+        if stream is DELETED:
+            for name, key in rows:
+                if name in STREAMS_BY_NAME:
+                    deleted.setdefault(name, []).append(STREAMS_BY_NAME[name].model._meta.pk.to_python(key))
+        elif rows:
+            changes[stream.name] = {'fields': stream.columns(), 'rows': rows}
+
+    return {
+        'reset': reset,
+        'deleted': deleted,
+        'changes': changes,
+        'more': more,
+        'cursor': makeCursor(user.pk, now, positions),
+    }
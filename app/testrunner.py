@@ -0,0 +1,30 @@
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import metrics
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with a local memory cache and temporary MEDIA_ROOT and METRICS_DIR,
+    so a test run leaves no .cache/, .metrics/ or avatar files in the working tree.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.tempDir = tempfile.mkdtemp()
+        self.testSettings = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            MEDIA_ROOT=f'{self.tempDir}/media',
+            METRICS_DIR=f'{self.tempDir}/metrics',
+        )
+        self.testSettings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        metrics.store.clear()  # Or the atexit flush writes it to the real METRICS_DIR
+        self.testSettings.disable()
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
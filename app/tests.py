@@ -1,3 +1,537 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.forms import modelform_factory
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+import numpy as np
+from openpyxl import load_workbook
+from PIL import Image
+
+from . import metrics
+from .arrears import computeArrears
+from .exports import LEDGER_HEADER
+from .importers import LedgerImporter, importPayments
+from .models import Account, Contract, Customer, Guarantor, Payment, ShopStats
+from .utils import defaultAvatar, normalizePhone
+from .routers import REPLICA, ReplicaRouter, isPinned, pinToPrimary, replicaReads
+
+
+AVATAR = 'customer/avatars/0123456789abcdef0123456789abcdef.jpg'
+
+# Queries of every view, whatever the number of rows. The 2 of each request are
+# the session and the user of the logged in client.
+BUDGETS = {
+    'login': 0,
+    'logout': 4,
+    'signUp': 0,
+    'home': 2,
+    'dashboardStats': 3,
+    'accounts': 3,
+    'searchAccounts': 7,
+    'overdueAccounts': 3,
+    'accountDetails': 5,
+    'avatar': 0,
+    'createPayment': 10,
+    'importPayments': 18,
+    'createPayments': 10,
+    'exportLedger': 4,
+    'createAccountForm': 2,
+    'preCreationData': 5,
+    'createAccount': 19,
+    'createCustomer': 5,
+    'createGuarantor': 5,
+    'sync': 8,
+    'productList': 3,
+    'createProduct': 4,
+    'metrics': 0,
+    'adminCustomers': 5,
+    'adminContracts': 5,
+    'adminPayments': 6,
+    'adminAccounts': 5,
+    'adminSummaries': 5,
+}
+
+
+def ledgerRow(i):
+    return {
+        'accountNumber': f'abc-h{i}',
+        'saleDate': '2024-01-15',
+        'customerName': f'Customer {i}',
+        'customerPhone': f'0171{i:07d}',
+        'customerAddress': f'House {i}, Mirpur, Dhaka',
+        'guarantor1Name': f'Guarantor {i}',
+        'guarantor1Phone': f'0181{i:07d}',
+        'guarantor2Name': f'Guarantor {i + 1}',
+        'guarantor2Phone': f'0181{i + 1:07d}',
+        'productModel': f'tv-{i % 5}',
+        'productCategory': 'Television',
+        'cashValue': 30000,
+        'hireValue': 36000,
+        'downPayment': 6000,
+        'monthlyPayment': 2500,
+        'length': 12,
+    }
+
+
+class QueryBudgetTests(TestCase):
+    """ Runs every view against a shop of `rows` accounts, each with a payment. """
+    rows = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shop', password='secret')
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+
+        LedgerImporter(cls.user).run(enumerate((ledgerRow(i) for i in range(cls.rows)), 2))
+        importPayments(enumerate(({'account': f'abc-h{i}', 'receiptId': f'r-{i}', 'date': '2024-02-15', 'amount': 2500}
+            for i in range(cls.rows)), 2), creator=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        metrics.store.clear()
+
+    def request(self, budget, method, url, status=200, **kwargs):
+        """ Request `url`, running the on-commit callbacks too, in exactly BUDGETS[budget] queries. """
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(BUDGETS[budget]):
+            response = getattr(self.client, method)(url, **kwargs)
+            if response.streaming:
+                response.streamedContent = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status)
+        return response
+
+    def postJson(self, budget, url, data, status=200):
+        response = self.request(budget, 'post', url, status, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success', response.json())
+        return response
+
+    # ++++++++++++++++ PAGES +++++++++++++++++++
+
+    def test_login(self):
+        self.client.logout()
+        self.request('login', 'get', '/user/login/')
+
+    def test_logout(self):
+        self.request('logout', 'get', '/user/logout/', status=302)
+
+    def test_sign_up(self):
+        self.client.logout()
+        self.request('signUp', 'get', '/user/sign-up/')
+
+    def test_home(self):
+        self.request('home', 'get', '/')
+
+    def test_account_details(self):
+        response = self.request('accountDetails', 'get', '/account/get/ABC-H0/')
+        self.assertEqual(response.context['firstGuarantor'].name, 'Guarantor 1')
+
+    def test_create_account_form(self):
+        self.request('createAccountForm', 'get', '/account/new/')
+
+    def test_product_list(self):
+        self.request('productList', 'get', '/product/list/')
+
+    def test_conditional_page_after_login(self):
+        self.client.get('/account/get/ABC-H0/')  # Sets the CSRF cookie
+        etag = self.client.get('/account/get/ABC-H0/')['ETag']
+        self.assertEqual(self.client.get('/account/get/ABC-H0/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A new session renders a new CSRF token, the cached page must not be reused
+        self.client.logout()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/account/get/ABC-H0/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_conditional_page_ignores_modified_since(self):
+        response = self.client.get('/account/get/ABC-H0/', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_avatar(self):
+        storage = Customer._meta.get_field('avatar').storage
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 400), 'red').save(buffer, format='JPEG')
+        storage.save(AVATAR, ContentFile(buffer.getvalue()))
+        storage.save(defaultAvatar, ContentFile(buffer.getvalue()))
+        self.client.logout()
+        response = self.request('avatar', 'get', f'/avatar/list/{AVATAR}')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        # Replaced in place, so not immutable
+        response = self.request('avatar', 'get', f'/avatar/list/{defaultAvatar}')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    # ++++++++++++++++ JSON / FILE ENDPOINTS +++++++++++++++++++
+
+    def test_dashboard_stats(self):
+        response = self.request('dashboardStats', 'get', '/dashboard/stats/')
+        self.assertEqual(response.json()['stats']['activeAccounts'], self.rows)
+
+    def test_accounts(self):
+        response = self.request('accounts', 'get', '/accounts/get/', data={'limit': 50})
+        self.assertEqual(len(response.json()['accounts']), min(self.rows, 50))
+
+    def test_accounts_by_number(self):
+        response = self.request('accounts', 'get', '/accounts/get/', data={'q': 'h0'})
+        self.assertEqual([row['account'] for row in response.json()['accounts']], ['ABC-H0'])
+
+    def test_search_accounts(self):
+        response = self.request('searchAccounts', 'get', '/accounts/search/', data={'q': 'customr 0'})
+        self.assertEqual(response.json()['accounts'][0]['account'], 'ABC-H0')
+
+    def test_search_closed_accounts(self):
+        # Every customer matches equally, the closed account ranks last among them
+        account = Account.objects.get(pk=f'ABC-H{self.rows - 1}')
+        account.isActive = False
+        account.save()
+        response = self.request('searchAccounts', 'get', '/accounts/search/', data={'q': 'customer', 'limit': 1, 'status': 'closed'})
+        self.assertEqual([row['account'] for row in response.json()['accounts']], [account.pk])
+
+    def test_overdue_accounts(self):
+        response = self.request('overdueAccounts', 'get', '/accounts/overdue/', data={'asOf': '2024-06-15', 'limit': 50})
+        self.assertEqual(len(response.json()['accounts']), min(self.rows, 50))
+
+    def test_pre_creation_data(self):
+        response = self.request('preCreationData', 'get', '/account-precreation/data/')
+        self.assertEqual(len(response.json()['data']['customers']), self.rows)
+
+    def test_pre_creation_delta(self):
+        version = self.client.get('/account-precreation/data/').json()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            # A customer with a lower uid committed late (uid blocks are reserved ahead), and an edited one
+            Customer.objects.create(uid=1, creator=self.user, name='Late', phone='01999000000', address='Uttara')
+            customer = self.user.customers.get(phoneE164=normalizePhone('01710000000'))
+            customer.name = 'Renamed'
+            customer.save()
+
+        response = self.client.get('/account-precreation/data/', {'version': version}).json()
+        self.assertTrue(response['delta'])
+        self.assertTrue({'Late', 'Renamed'} <= {row['name'] for row in response['data']['customers']})
+
+    def test_export_ledger(self):
+        self.request('exportLedger', 'get', '/ledger/export/')
+
+    def test_export_ledger_xlsx(self):
+        response = self.request('exportLedger', 'get', '/ledger/export/', data={'format': 'xlsx'})
+        sheet = load_workbook(io.BytesIO(response.streamedContent), read_only=True)['Ledger']
+        rows = list(sheet.values)
+        self.assertEqual(rows[0], tuple(LEDGER_HEADER))
+        self.assertEqual(len(rows), self.rows + 1)
+
+    def test_create_payment(self):
+        self.postJson('createPayment', '/account/get/ABC-H0/make-payment/',
+            {'paymentAmount': 2500, 'receiptNumber': 'new-1', 'paymentDate': str(date(2024, 3, 15))})
+
+    def test_import_payments(self):
+        upload = SimpleUploadedFile('payments.csv', b'account,receiptId,date,amount\nabc-h0,new-1,2024-03-15,2500\n')
+        response = self.request('importPayments', 'post', '/payment/import/', data={'file': upload})
+        self.assertEqual(response.json()['data']['created'], 1)
+
+    def test_create_payments(self):
+        response = self.postJson('createPayments', '/payment/batch/', {'payments': [
+            {'account': 'abc-h0', 'receiptId': 'new-1', 'date': '2024-03-15', 'amount': 2500},
+            {'account': 'abc-h0', 'receiptId': 'new-2', 'date': '2024-04-15', 'amount': 2500},
+            {'account': 'abc-h0', 'receiptId': 'r-0', 'date': '2024-02-15', 'amount': 2500},
+            {'account': 'xyz-h1', 'receiptId': 'new-3', 'date': '2024-03-15', 'amount': 2500},
+        ]})
+        results = response.json()['data']['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'created', 'duplicate', 'error'])
+        self.assertEqual(results[1]['cashBalance'], 24000 - 3 * 2500)
+
+    def test_create_account(self):
+        customer = self.user.customers.first()
+        guarantor = self.user.guarantors.first()
+        self.postJson('createAccount', '/account/create/', {
+            'accountNumber': 'xyz-h1', 'customerUid': customer.uid, 'selectedModel': 'TV-0',
+            'firstGuarantorUid': guarantor.uid, 'secondGuarantorUid': guarantor.uid,
+            'cashValue': 30000, 'hireValue': 36000, 'downPayment': 6000, 'monthlyPayment': 2500,
+            'length': 12, 'saleDate': '2024-03-01',
+        })
+
+    def test_create_customer(self):
+        self.postJson('createCustomer', '/customer/create/', {'fullname': 'New', 'phone': '01999000000', 'address': 'Uttara', 'age': 30}, status=201)
+
+    def test_create_guarantor(self):
+        self.postJson('createGuarantor', '/guarantor/create/', {'guarantorName': 'New', 'guarantorPhone': '01999000000'}, status=201)
+
+    def test_create_product(self):
+        self.postJson('createProduct', '/product/create/', {'category': 'Television', 'model': 'new-tv'})
+
+    @override_settings(SYNC_OVERLAP_SECONDS=0)
+    def test_sync(self):
+        batch = {'more': True}
+        while batch['more']:  # Full sync first
+            batch = self.client.get('/sync/', {'limit': 2000, 'cursor': batch.get('cursor', '')}).json()
+
+        payment = Payment.objects.get(receiptId='r-0')
+        Payment.objects.create(contract_id=payment.contract_id, receiptId='new-1', date=date(2024, 3, 15), amount=2500)
+        Payment.objects.filter(pk=payment.pk).delete()
+
+        batch = self.request('sync', 'get', '/sync/', data={'cursor': batch['cursor']}).json()
+        self.assertFalse(batch['reset'])
+        self.assertEqual(batch['deleted'], {'payments': [payment.pk]})
+        payments = batch['changes']['payments']
+        self.assertEqual([dict(zip(payments['fields'], row))['receiptId'] for row in payments['rows']], ['new-1'])
+        contracts = batch['changes']['contracts']
+        self.assertIn(payment.contract_id, [row[0] for row in contracts['rows']])
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    async def test_slow_request_log(self):
+        await self.async_client.aforce_login(self.user)
+        with self.assertLogs('app.profiling') as logs:
+            response = await self.async_client.get('/account-precreation/data/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['user'], self.user.pk)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_server_timing(self):
+        response = self.request('home', 'get', '/')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries", tpl;dur=')
+
+    def test_metrics(self):
+        self.request('home', 'get', '/')
+        self.client.logout()
+        body = self.request('metrics', 'get', '/metrics').content.decode()
+        self.assertIn('cms_http_request_duration_seconds_count{method="GET",view="home"}', body)
+        self.assertIn('cms_http_request_db_queries_bucket{view="home",le="2"}', body)
+
+    # ++++++++++++++++ ADMIN +++++++++++++++++++
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        self.request('adminCustomers', 'get', '/admin/app/customer/')
+        self.request('adminContracts', 'get', '/admin/app/contract/')
+        self.request('adminPayments', 'get', '/admin/app/payment/')
+        self.request('adminAccounts', 'get', '/admin/app/account/')
+        self.request('adminSummaries', 'get', '/admin/app/accountsummary/')
+
+
+class QueryBudget10Tests(QueryBudgetTests):
+    rows = 10
+
+
+class QueryBudget1000Tests(QueryBudgetTests):
+    rows = 1000
+
+
+class BalanceTests(TestCase):
+    """ Contract balances and dashboard totals kept by the signals, against a rebuild from the payments. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shop', password='secret')
+        LedgerImporter(cls.user).run(enumerate((ledgerRow(i) for i in range(2)), 2))
+
+    def assertStatsReconciled(self):
+        stats = ShopStats.objects.get(pk=self.user.pk).asDict()
+        ShopStats.reconcile([self.user.pk])
+        self.assertEqual(stats, ShopStats.objects.get(pk=self.user.pk).asDict())
+
+    def test_contract_save_after_payment(self):
+        contract = Contract.objects.get(account__pk='ABC-H0')
+        Payment(contract=contract, receiptId='p-1', date=date(2024, 2, 15), amount=2500).save()
+        contract.cashValue += 10
+        contract.save()
+
+        self.assertEqual(contract.cashBalance, 30010 - 6000 - 2500)
+        self.assertStatsReconciled()
+
+    def test_stale_contract_save(self):
+        stale = Contract.objects.get(account__pk='ABC-H0')
+        Payment(contract=Contract.objects.get(pk=stale.pk), receiptId='p-1', date=date(2024, 2, 15), amount=2500).save()
+        stale.monthlyPayment += 100
+        stale.save()
+
+        self.assertEqual(stale.cashBalance, 30000 - 6000 - 2500)
+        self.assertStatsReconciled()
+
+    def test_duplicate_receipt(self):
+        contract = Contract.objects.get(account__pk='ABC-H0')
+        Payment(contract=contract, receiptId='p-1', date=date(2024, 2, 15), amount=2500).save()
+        with self.assertRaisesMessage(ValidationError, '"p-1" this receipt ID already exists.'):
+            Payment(contract=contract, receiptId='p-1', date=date(2024, 3, 15), amount=2500).save()
+
+        contract.refresh_from_db()
+        self.assertEqual(contract.paidTotal, 2500)
+        self.assertStatsReconciled()
+
+    def test_payment_moved_to_another_contract(self):
+        first, second = Contract.objects.get(account__pk='ABC-H0'), Contract.objects.get(account__pk='ABC-H1')
+        Payment.objects.create(contract=first, receiptId='p-1', date=timezone.localdate(), amount=2500)
+
+        payment = Payment.objects.get(receiptId='p-1')
+        payment.contract, payment.amount = second, 3000
+        payment.save()
+
+        for contract in (first, second):
+            contract.refresh_from_db()
+            self.assertEqual(contract.paidTotal, contract.aggregatePaid())
+            self.assertEqual(contract.cashBalance, contract.cashValue - contract.totalPaid)
+        self.assertEqual((first.paidTotal, second.paidTotal), (0, 3000))
+        self.assertStatsReconciled()
+
+
+class ArrearsTests(SimpleTestCase):
+    def test_compute_arrears(self):
+        # (saleDate, hireValue, paidTotal) of 6000 down and 12 installments of 2500, as of 2024-06-15
+        cases = [
+            ('2024-01-15', 36000, 0),      # 5 installments due, none paid
+            ('2024-01-15', 36000, 11000),  # Part payment: 4.4 installments paid
+            ('2024-01-20', 36000, 10000),  # 5th installment not due before the 20th
+            ('2022-01-15', 36000, 25000),  # Past its length: all 12 installments due
+            ('2022-01-15', 34000, 25000),  # ... but never more than the hire value
+            ('2024-07-01', 36000, 0),      # Sold in the future
+        ]
+        contracts = computeArrears({
+            'saleDate': np.array([case[0] for case in cases], dtype='datetime64[D]'),
+            'downPayment': np.full(len(cases), 6000),
+            'monthlyPayment': np.full(len(cases), 2500),
+            'length': np.full(len(cases), 12),
+            'hireValue': np.array([case[1] for case in cases]),
+            'paidTotal': np.array([case[2] for case in cases]),
+        }, date(2024, 6, 15))
+
+        self.assertEqual(contracts['expected'].tolist(), [18500, 18500, 16000, 36000, 34000, 0])
+        self.assertEqual(contracts['paid'].tolist(), [6000, 17000, 16000, 31000, 31000, 6000])
+        self.assertEqual(contracts['arrears'].tolist(), [12500, 1500, 0, 5000, 3000, 0])
+        self.assertEqual(contracts['monthsOverdue'].tolist(), [5, 1, 0, 2, 2, 0])
+
+
+class PhoneTests(SimpleTestCase):
+    def test_normalize_phone(self):
+        for phone in ('01711223344', '01711-223344', '(017) 1122 3344', '+8801711223344', '+880 1711-223344',
+                '8801711223344', '008801711223344', '1711223344'):
+            self.assertEqual(normalizePhone(phone), '+8801711223344', phone)
+        self.assertEqual(normalizePhone('+44 20 7946 0958'), '+442079460958')
+
+        for phone in (None, '', '01234', '+8801711223344556', 'call me', '01711 22334x'):
+            self.assertIsNone(normalizePhone(phone), phone)
+
+
+class PhoneValidationTests(TestCase):
+    def test_duplicate_in_another_format(self):
+        user = User.objects.create_user('shop', password='secret')
+        Customer.objects.create(creator=user, name='First', phone='01711223344', address='Mirpur')
+        Guarantor.objects.create(creator=user, name='First', phone='01811223344')
+
+        for model, phone in ((Customer, '01711-223344'), (Guarantor, '8801811223344')):
+            form = modelform_factory(model, fields=['name', 'phone', 'address'])(
+                {'name': 'Second', 'phone': phone, 'address': 'Uttara'}, instance=model(creator=user))
+            self.assertFalse(form.is_valid())
+            self.assertIn('already has this phone number', form.errors['phone'][0])
+
+        # Another shop may have the same number
+        other = User.objects.create_user('other', password='secret')
+        form = modelform_factory(Customer, fields=['name', 'phone', 'address'])(
+            {'name': 'Second', 'phone': '+8801711223344', 'address': 'Uttara'}, instance=Customer(creator=other))
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class NormalizePhonesTests(TestCase):
+    def test_backfill(self):
+        user = User.objects.create_user('shop', password='secret')
+        other = User.objects.create_user('other', password='secret')
+        Customer.objects.create(uid=1, creator=user, name='Normalized', phone='01811000000', address='Mirpur')
+        # bulk_create skips save(), leaving phoneE164 empty as before the backfill
+        Customer.objects.bulk_create([
+            Customer(uid=2, creator=user, name='Local', phone='01711-223344', address='Mirpur'),
+            Customer(uid=3, creator=user, name='Same number', phone='+880 1711 223344', address='Mirpur'),
+            Customer(uid=4, creator=other, name='Other shop', phone='8801711223344', address='Mirpur'),
+            Customer(uid=5, creator=user, name='Same as normalized', phone='+8801811000000', address='Mirpur'),
+            Customer(uid=6, creator=user, name='Invalid', phone='call me', address='Mirpur'),
+        ])
+        Guarantor.objects.bulk_create([Guarantor(uid=1, creator=user, name='No phone')])
+
+        out = io.StringIO()
+        call_command('normalize_phones', dry_run=True, stdout=out)
+        self.assertEqual(Customer.objects.exclude(phoneE164=None).count(), 1)
+
+        out = io.StringIO()
+        call_command('normalize_phones', batch_size=2, stdout=out)
+        self.assertEqual(dict(Customer.objects.values_list('uid', 'phoneE164')), {
+            1: '+8801811000000', 2: '+8801711223344', 3: None, 4: '+8801711223344', 5: None, 6: None,
+        })
+        self.assertIn('Normalized 2 customers; 2 collisions, 1 invalid numbers.', out.getvalue())
+        self.assertIn('Normalized 0 guarantors; 0 collisions, 0 invalid numbers.', out.getvalue())
+        self.assertIn('customers 3: "+880 1711 223344" is +8801711223344, already used by 2', out.getvalue())
+
+
+
+class GcAvatarsTests(TestCase):
+    def test_rehash(self):
+        user = User.objects.create_user('shop', password='secret')
+        LedgerImporter(user).run(enumerate([ledgerRow(0)], 2))
+        buffer = io.BytesIO()
+        Image.new('RGB', (80, 80), 'blue').save(buffer, format='JPEG')
+        legacy = Customer._meta.get_field('avatar').storage.save('customer/avatars/photo_1.JPG', ContentFile(buffer.getvalue()))
+        Customer.objects.filter(creator=user).update(avatar=legacy)
+
+        self.client.force_login(user)
+        etag = self.client.get('/accounts/get/')['ETag']
+        dataVersion = self.client.get('/account-precreation/data/').json()['version']
+
+        call_command('gc_avatars', rehash=True, min_age=0, stdout=io.StringIO())
+
+        customer = Customer.objects.get(creator=user)
+        self.assertRegex(customer.avatar.name, r'^customer/avatars/[0-9a-f]{32}\.jpg$')
+        self.assertEqual(Account.objects.get(pk='ABC-H0').summary.avatar, customer.avatar.name)
+        self.assertFalse(customer.avatar.storage.exists(legacy))
+        self.assertEqual(self.client.get('/accounts/get/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        delta = self.client.get('/account-precreation/data/', {'version': dataVersion}).json()
+        self.assertEqual([row['uid'] for row in delta['data']['customers']], [customer.uid])
+
+
+class MetricsStoreTests(SimpleTestCase):
+    def test_flush_off_the_request_path(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+
+        with override_settings(METRICS_DIR=directory, METRICS_FLUSH_INTERVAL=0.05):
+            store = metrics.Store()
+            store.inc('cms_payments_posted_total', source='single')
+            self.assertFalse(os.path.exists(path))  # Recording doesn't write
+
+            for _ in range(100):  # The background thread does
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            with open(path) as file:
+                self.assertEqual(json.load(file), [['cms_payments_posted_total', [['source', 'single']], 1]])
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_routing(self):
+        router = ReplicaRouter()
+        fromReplica = Account()
+        fromReplica._state.db = REPLICA
+
+        self.assertEqual(router.db_for_read(Account), 'default')
+        token = replicaReads.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Account), REPLICA)
+            self.assertEqual(router.db_for_write(Account, instance=fromReplica), 'default')
+        finally:
+            replicaReads.reset(token)
+        self.assertFalse(router.allow_migrate(REPLICA, 'app'))
+
+    def test_pin(self):
+        pinToPrimary(1)
+        self.assertTrue(isPinned(1))
+        self.assertFalse(isPinned(2))
@@ -1,27 +1,38 @@
 from django.urls import path
 
 from .views import LoginView, LogoutView, SignUpView
-from .views import ( HomeView, GetAccounts, AccountDetailsView, CreateAccountForm, 
+from .views import ( HomeView, DashboardStats, GetAccounts, SearchAccounts, OverdueAccounts, AccountDetailsView, CreateAccountForm, 
     CreateAccount, GetPreCreationData, CreateCustomer, CreateGuarantor, CreatePayment,
-    productList, createProduct )
+    CreatePayments, ImportPayments, ExportLedger, AvatarRendition, productList, createProduct, SyncChanges, Metrics )
 
 urlpatterns = [
     path('user/login/', LoginView, name='login'),
     path('user/logout/', LogoutView, name='logout'),
     path('user/sign-up/', SignUpView, name='sign-up'),
     path('', HomeView, name='home'),
+    path('dashboard/stats/', DashboardStats, name='dashboard-stats'),
 
-    path('accounts/get/', GetAccounts),
+    path('accounts/get/', GetAccounts, name='accounts'),
+    path('accounts/search/', SearchAccounts, name='search-accounts'),
+    path('accounts/overdue/', OverdueAccounts, name='overdue-accounts'),
     path('account/get/<str:pk>/', AccountDetailsView, name='account'),
-    path('account/get/<str:pk>/make-payment/', CreatePayment),
+    path('avatar/<str:size>/<path:name>', AvatarRendition, name='avatar'),
+    path('account/get/<str:pk>/make-payment/', CreatePayment, name='make-payment'),
+    path('payment/import/', ImportPayments, name='import-payments'),
+    path('payment/batch/', CreatePayments, name='batch-payments'),
+    path('ledger/export/', ExportLedger, name='export-ledger'),
 
     path('account/new/', CreateAccountForm, name='create-account'),
-    path('account-precreation/data/', GetPreCreationData),
-    path('account/create/', CreateAccount),
+    path('account-precreation/data/', GetPreCreationData, name='precreation-data'),
+    path('account/create/', CreateAccount, name='save-account'),
 
-    path('customer/create/', CreateCustomer),
-    path('guarantor/create/', CreateGuarantor),
+    path('customer/create/', CreateCustomer, name='create-customer'),
+    path('guarantor/create/', CreateGuarantor, name='create-guarantor'),
 
     path('product/list/', productList, name='products'),
-    path('product/create/', createProduct),
+    path('product/create/', createProduct, name='create-product'),
+
+    path('sync/', SyncChanges, name='sync'),
+
+    path('metrics', Metrics, name='metrics'),
 ]
@@ -1,6 +1,23 @@
 # ++++++++++++++++ MODELS CONSTANT +++++++++++++++++++
 defaultAvatar = 'customer/avatars/default.png'
 
+# Square avatar renditions in px (2x of their CSS size)
+AVATAR_RENDITIONS = {
+    'thumb': 48,    # admin previews
+    'list': 80,     # home list rows (w-10)
+    'detail': 320,  # account details header (w-40)
+}
+
+# Threads resizing images for async views, so a big avatar never blocks the event loop
+IMAGE_THREADS = 4
+
+# Country code assumed for phone numbers entered without one (Bangladesh)
+PHONE_COUNTRY_CODE = '880'
+
+# Custom uids start right after these values
+CUSTOMER_UID_FLOOR = 1000000
+GUARANTOR_UID_FLOOR = 5000000
+
 GUARDIAN_TYPES = [
     ('Father', 'Father'),
     ('Husband', 'Husband')
@@ -38,16 +55,39 @@ PRODUCT_CATEGORIES = [
 
 
 # ++++++++++++++++ MODELS UTILITY +++++++++++++++++++
+import asyncio
+import contextvars
 import os
+import re
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from django.core.exceptions import ValidationError
 
-from PIL import Image
+from PIL import Image, ImageOps
 from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.urls import reverse
+
+from . import metrics
+from .profiling import profiled
+
+
+imageExecutor = ThreadPoolExecutor(max_workers=IMAGE_THREADS, thread_name_prefix='image')
+
+
+async def inImagePool(function, *args):
+    """ Await `function(*args)` run on the image threads, keeping the caller's profile. """
+    call = partial(contextvars.copy_context().run, function, *args)
+    return await asyncio.get_running_loop().run_in_executor(imageExecutor, call)
 
 
 
+@profiled('avatar')
 def compressAvatar(image):
     if not image:
         return image  # Return the original if no image is provided
@@ -63,10 +103,12 @@ def compressAvatar(image):
     if img.format not in ['JPG', 'JPEG', 'PNG']:
         raise ValidationError(f"Unsupported image format: {img.format}")
 
-    img = img.convert('RGB')  # Ensure it's a standard format for JPEG compression
-    
+    started = time.perf_counter()
+
     # Resize while maintaining aspect ratio (Max: 500x500)
     max_size = (500, 500)
+    img.draft('RGB', max_size)  # Let JPEGs decode at a reduced scale
+    img = img.convert('RGB')  # Ensure it's a standard format for JPEG compression
     img.thumbnail(max_size, Image.LANCZOS)
 
     # Save the compressed image to memory with better quality
@@ -74,15 +116,127 @@ def compressAvatar(image):
     img.save(buffer, format='JPEG', quality=90, optimize=True, progressive=True)
     buffer.seek(0)
 
+    metrics.observe('cms_avatar_compress_seconds', time.perf_counter() - started)
+    metrics.inc('cms_avatar_bytes_saved_total', max(image.size - buffer.getbuffer().nbytes, 0))
+
     # Return as InMemoryUploadedFile to save to the model's ImageField
-    return InMemoryUploadedFile(buffer, None, image.name, 'image/jpeg', buffer.tell(), None)
+    name = Path(image.name).with_suffix('.jpg').name
+    return InMemoryUploadedFile(buffer, None, name, 'image/jpeg', buffer.getbuffer().nbytes, None)
+
 
 
+def fileDigest(file):
+    """ Hex digest of a file's content, used as its content-addressed name. """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()[:32]
+
 
 def customerAvatarPath(instance, filename):
+    """
+    Avatars are named after a hash of their processed bytes, so identical uploads
+    share one file and a changed avatar always gets a new, immutable URL.
+    """
     folder_name = f"customer/avatars/"
-    ext = Path(filename).suffix  # Extracts file extension
+    ext = Path(filename).suffix.lower()  # Extracts file extension
 
-    new_filename = f"avatar_{instance.name}{ext}"
+    new_filename = f"{fileDigest(instance.avatar.file)}{ext}"
     return str(Path(folder_name) / new_filename)
 
+
+class AvatarStorage(FileSystemStorage):
+    """ Content-addressed storage: a name that already exists holds the same bytes, reuse it. """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+def avatarStorage():
+    return AvatarStorage()
+
+
+
+def avatarRenditionName(name, size, fmt):
+    """ Storage name of a rendition, next to its original: avatar_x.jpg -> avatar_x.list.webp """
+    path = Path(name)
+    return str(path.with_name(f'{path.stem}.{size}.{fmt}'))
+
+
+def isContentAddressed(name):
+    """ Whether an avatar is named by a hash of its content, see customerAvatarPath; default.png and legacy names aren't. """
+    return re.fullmatch(r'[0-9a-f]{32}', Path(Path(name).stem).stem) is not None
+
+
+def isAvatarName(name):
+    """ Only original avatars stored under customer/avatars/ can be rendered. """
+    path = Path(name)
+    if '..' in path.parts or not name.startswith('customer/avatars/'):
+        return False
+    return Path(path.stem).suffix.lstrip('.') not in AVATAR_RENDITIONS
+
+
+def avatarRendition(name, size, fmt):
+    """
+    Return the storage name of the `size` rendition of avatar `name` in `fmt`
+    ('webp' or 'jpeg'), generating and storing it on first use.
+    """
+    from .models import Customer  # models imports this module
+    storage = Customer._meta.get_field('avatar').storage
+
+    rendition = avatarRenditionName(name, size, fmt)
+    exists = storage.exists(rendition)
+    metrics.cacheLookup('avatar-rendition', exists)
+    if exists:
+        return rendition
+
+    pixels = AVATAR_RENDITIONS[size]
+    with storage.open(name, 'rb') as file:
+        img = Image.open(file)
+        img.draft('RGB', (pixels, pixels))  # JPEGs decode at 1/2, 1/4 or 1/8 scale
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        img = ImageOps.fit(img, (pixels, pixels), Image.LANCZOS)
+
+    buffer = BytesIO()
+    if fmt == 'webp':
+        img.save(buffer, format='WEBP', quality=80, method=4)
+    else:
+        img.save(buffer, format='JPEG', quality=85, optimize=True, progressive=True)
+
+    if not storage.exists(rendition):  # Another request may have just created it
+        storage.save(rendition, ContentFile(buffer.getvalue()))
+    return rendition
+
+
+def avatarRenditionUrl(name, size):
+    return reverse('avatar', args=[size, name]) if name else None
+
+
+
+def normalizePhone(phone, countryCode=PHONE_COUNTRY_CODE):
+    """
+    Canonical E.164 form of a phone number ("+8801711223344" for "01711-223344",
+    "+880 1711 223344", "008801711223344" ...), or None when it can't be one.
+    """
+    if not phone:
+        return None
+    digits = re.sub(r'[\s\-().]', '', str(phone))
+
+    if digits.startswith('+'):
+        digits = digits[1:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):  # National trunk prefix
+        digits = countryCode + digits[1:]
+    elif not digits.startswith(countryCode):
+        digits = countryCode + digits
+
+    if not digits.isdigit() or not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
@@ -1,13 +1,33 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse, Http404
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils.crypto import constant_time_compare
 import json
+import tempfile
+from datetime import timedelta
 
-from .models import ( Account, Customer, Guarantor, 
-    Product, Contract, Payment, PRODUCT_CATEGORIES, OCCUPATIONS )
+from .models import ( Account, AccountSummary, Customer, Guarantor, 
+    Product, Contract, Payment, ShopStats, PRODUCT_CATEGORIES, OCCUPATIONS )
 from .forms import CustomUserCreationForm
+from .utils import ( AVATAR_RENDITIONS, avatarRendition, avatarRenditionUrl, inImagePool, isAvatarName, isContentAddressed,
+    normalizePhone )
+from .importers import MAX_POSTED_PAYMENTS, detectFormat, importPayments, postPayments, readRows
+from .exports import csvLines, ledgerRows, parseDate, writeXlsx
+from . import metrics
+from .arrears import overdueAccounts
+from .routers import replicaView
+from .search import SEARCH_LIMIT, SEARCH_MAX_LIMIT, searchAccounts
+from .sync import SYNC_BATCH_SIZE, SYNC_MAX_BATCH_SIZE, syncBatch
+from .caching import ( PRODUCTS_VERSION_KEY, accountVersionKey, accountsEpochKey, accountsVersionKey, cachedPreCreationData,
+    conditionalOn, parsePreCreationToken, preCreationToken, productVersion, userDataVersion, versionTime )
 
 
 def LoginView(request):
@@ -62,36 +82,171 @@ def HomeView(request):
     return render(request, 'pages/home.html')
 
 @login_required
-def GetAccounts(request):
-    user = request.user
+def DashboardStats(request):
+    stats = ShopStats.objects.filter(pk=request.user.pk).first()
+    if not stats:
+        ShopStats.reconcile([request.user.pk])
+        stats = ShopStats.objects.get(pk=request.user.pk)
+    return JsonResponse({'success': True, 'stats': stats.asDict()})
 
-    accounts = user.accounts.all()
-    if not accounts:
-        return JsonResponse({'success': False})
-    
-    serialized_data = [{
-        'pk': acc.pk,
-        'name': acc.customer.name if acc.customer else "Unknown",
-        'phone': acc.customer.phone if acc.customer else "N/A",
-        'account': acc.accountNumber,
-        'balance': acc.contract.cashBalance if acc.contract else 0,
-        'avatar': acc.customer.avatar.url if acc.customer else None,
-        'isActive': acc.isActive,
-    } for acc in accounts]
-    return JsonResponse({'success': True, 'accounts': serialized_data})
+ACCOUNTS_PAGE_SIZE = 50
+ACCOUNTS_MAX_PAGE_SIZE = 200
+
+@login_required
+@replicaView
+@conditionalOn(lambda request: [accountsVersionKey(request.user.pk)])
+async def GetAccounts(request):
+    """
+    Keyset paginated account list, read from the AccountSummary table. Query params:
+        cursor: accountNumber of the last row of the previous page
+        limit:  page size (max ACCOUNTS_MAX_PAGE_SIZE)
+        q, by:  search text and field (name, phone, account, balance)
+        status: active, closed or all
+    """
+    user = await request.auser()
+
+    try:
+        limit = min(int(request.GET.get('limit', ACCOUNTS_PAGE_SIZE)), ACCOUNTS_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid page size.'}, status=400)
+    if limit < 1:
+        return JsonResponse({'success': False, 'message': 'Invalid page size.'}, status=400)
+
+    accounts = AccountSummary.objects.filter(creator=user).order_by('-account_id')
+
+    status = request.GET.get('status', 'all')
+    if status == 'active':
+        accounts = accounts.filter(isActive=True)
+    elif status == 'closed':
+        accounts = accounts.filter(isActive=False)
+
+    query = request.GET.get('q', '').strip()
+    if query:
+        searchBy = request.GET.get('by', 'account')
+        if searchBy == 'name':
+            accounts = accounts.filter(name__icontains=query)
+        elif searchBy == 'phone':
+            accounts = accounts.filter(phone__icontains=query)
+        elif searchBy == 'balance':
+            try:
+                accounts = accounts.filter(cashBalance=int(query))
+            except ValueError:
+                accounts = accounts.none()
+        else:
+            # The summary's own account_id column; account_id__icontains isn't a lookup of a OneToOneField
+            accounts = accounts.alias(accountNumber=F('account_id')).filter(accountNumber__icontains=query)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        accounts = accounts.filter(account_id__lt=cursor)
+
+    # Fetch one extra row to know whether another page exists
+    page = [summary async for summary in accounts[:limit + 1]]
+    hasMore = len(page) > limit
+    page = page[:limit]
+
+    return JsonResponse({
+        'success': True,
+        'accounts': [serializeSummary(summary) for summary in page],
+        'nextCursor': page[-1].account_id if hasMore else None,
+    })
+
+
+def serializeSummary(summary):
+    return {
+        'pk': summary.account_id,
+        'name': summary.name,
+        'phone': summary.phone,
+        'account': summary.account_id,
+        'balance': summary.cashBalance,
+        'avatar': avatarRenditionUrl(summary.avatar, 'list'),
+        'isActive': summary.isActive,
+    }
+
+
+@login_required
+@replicaView
+def SearchAccounts(request):
+    """
+    Typeahead search, best matches first. Query params:
+        q:      account number, customer name/address or guarantor name, typos allowed
+        limit:  number of results (max SEARCH_MAX_LIMIT)
+        status: active, closed or all
+    """
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid limit.'}, status=400)
+    if limit < 1:
+        return JsonResponse({'success': False, 'message': 'Invalid limit.'}, status=400)
+
+    matches = searchAccounts(request.user, request.GET.get('q', ''), limit, request.GET.get('status', 'all'))
+    results = [{**serializeSummary(summary), 'score': score, 'matched': matched} for summary, score, matched in matches]
+    return JsonResponse({'success': True, 'accounts': results})
+
+
+
+@login_required
+@replicaView
+def OverdueAccounts(request):
+    """ Active accounts behind their installment schedule. Query params: asOf, minMonths, limit """
+    try:
+        as_of = parseDate(request.GET.get('asOf'))
+        min_months = int(request.GET.get('minMonths', 1))
+        limit = min(int(request.GET.get('limit', ACCOUNTS_MAX_PAGE_SIZE)), ACCOUNTS_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid query parameters.'}, status=400)
+
+    accounts = overdueAccounts(request.user, as_of, min_months, limit)
+    return JsonResponse({'success': True, 'accounts': accounts})
 
 
 
 @login_required
+@replicaView
+@conditionalOn(lambda request, pk: [accountVersionKey(pk), accountsEpochKey(request.user.pk), PRODUCTS_VERSION_KEY])
 def AccountDetailsView(request, pk):
-    account = Account.objects.filter(pk=pk).first()
+    account = (Account.objects.select_related('customer', 'product', 'contract')
+        .prefetch_related('guarantors').filter(pk=pk).first())
 
     if not account:
         messages.info(request, 'The account you are trying to access does not exists!')
         return redirect('home')
     
     payments = account.contract.payments.all().order_by('date') if account.contract else None
-    return render(request, 'pages/accountDetails.html', {'account': account, 'payments': payments})
+    avatarUrl = avatarRenditionUrl(account.customer.avatar.name, 'detail')
+    guarantors = list(account.guarantors.all())
+    return render(request, 'pages/accountDetails.html', {
+        'account': account,
+        'payments': payments,
+        'avatarUrl': avatarUrl,
+        'firstGuarantor': guarantors[0] if guarantors else None,
+        'lastGuarantor': guarantors[-1] if guarantors else None,
+    })
+
+
+
+
+AVATAR_MAX_AGE = 365 * 24 * 60 * 60
+AVATAR_MUTABLE_MAX_AGE = 60 * 60  # default.png and legacy names, replaced in place
+
+async def AvatarRendition(request, size, name):
+    """ Resized customer avatar, WebP when the browser accepts it, JPEG otherwise. """
+    storage = Customer._meta.get_field('avatar').storage
+    if size not in AVATAR_RENDITIONS or not isAvatarName(name) or not await inImagePool(storage.exists, name):
+        raise Http404('Avatar not found')
+
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    rendition = await inImagePool(avatarRendition, name, size, fmt)
+
+    # Opening the file and FileResponse's size lookup hit the disk, off the event loop like the rest
+    response = await inImagePool(lambda: FileResponse(storage.open(rendition, 'rb'), content_type=f'image/{fmt}'))
+    if isContentAddressed(name):  # Named by a hash of its content, a rendition URL never changes its content
+        patch_cache_control(response, public=True, max_age=AVATAR_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=AVATAR_MUTABLE_MAX_AGE)
+    patch_vary_headers(response, ['Accept'])
+    return response
 
 
 
@@ -112,74 +267,128 @@ def CreateAccountForm(request):
 
 
 
+# creator is read by the related manager that built the queryset
+PERSON_FIELDS = ('uid', 'creator', 'name', 'phone', 'address', 'occupation')
+
+
+def serializePerson(person):
+    return {
+        'uid': person.uid,
+        'name': person.name,
+        'phone': person.phone,
+        'address': person.address,
+        'occupation': person.occupation
+    }
+
+
+def serializePeople(queryset):
+    return [serializePerson(person) for person in queryset.only(*PERSON_FIELDS)]
+
+
+async def aserializePeople(queryset):
+    return [serializePerson(person) async for person in queryset.only(*PERSON_FIELDS)]
+
+
+def serializeProduct(product):
+    return {
+        'category': product.category,
+        'model': product.model
+    }
+
+
+def serializeProducts():
+    return [serializeProduct(product) for product in Product.objects.only('category', 'model')]
+
+
+async def aserializeProducts():
+    return [serializeProduct(product) async for product in Product.objects.only('category', 'model')]
+
+
+def buildPreCreationData(user):
+    return {
+        'customers': serializePeople(user.customers.all()),
+        'guarantors': serializePeople(user.guarantors.all()),
+        'productCategories': [
+            {'value': category[0], 'name': category[1]}
+            for category in PRODUCT_CATEGORIES
+        ],
+        'products': serializeProducts(),
+    }
+
+
 @login_required
-def GetPreCreationData(request):
-    user = request.user
+async def GetPreCreationData(request):
+    """
+    Customers, guarantors and products for the account creation form. The payload is
+    cached per data version; a client sending back the `version` it holds gets either
+    `unchanged`, or a `delta` with the rows added or changed since (to replace by uid),
+    or the full payload when its copy can't be patched.
+    """
+    user = await request.auser()
 
     if request.method != 'GET':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
     
     try:
-        # Fetch customers and serialize
-        customers = user.customers.all()
-        serialized_customers = [
-            {
-                'uid': customer.uid,
-                'name': customer.name,
-                'phone': customer.phone,
-                'address': customer.address,
-                'occupation': customer.occupation
+        version, reset = await sync_to_async(userDataVersion)(user.pk)
+        products = await sync_to_async(productVersion)()
+        token = preCreationToken(user.pk, version, products)
+
+        held = parsePreCreationToken(request.GET.get('version'))
+        if held and held[0] == user.pk and reset <= held[1] <= version:
+            if held[1:] == (version, products):
+                return JsonResponse({'success': True, 'unchanged': True, 'version': token})
+
+            # Versions are bumped on commit, after updatedAt was set: look back for transactions that committed late
+            since = versionTime(held[1]) - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+            data = {
+                'customers': await aserializePeople(user.customers.filter(updatedAt__gte=since)) if held[1] != version else [],
+                'guarantors': await aserializePeople(user.guarantors.filter(updatedAt__gte=since)) if held[1] != version else [],
             }
-            for customer in customers
-        ]
+            if held[2] != products:
+                data['products'] = await aserializeProducts()
+            return JsonResponse({'success': True, 'delta': True, 'version': token, 'data': data})
 
-        # Fetch guarantors and serialize
-        guarantors = user.guarantors.all()
-        serialized_guarantors = [
-            {
-                'uid': guarantor.uid,
-                'name': guarantor.name,
-                'phone': guarantor.phone,
-                'address': guarantor.address,
-                'occupation': guarantor.occupation
-            }
-            for guarantor in guarantors
-        ]
+        # A miss builds the payload with the sync ORM, in a thread
+        data = await sync_to_async(cachedPreCreationData)(user.pk, version, products, lambda: buildPreCreationData(user))
+        return JsonResponse({'success': True, 'version': token, 'data': data})
 
-        # Prepare product categories
-        categories = [
-            {'value': category[0], 'name': category[1]}
-            for category in PRODUCT_CATEGORIES
-        ]
-
-        # Fetch products and serialize
-        products = Product.objects.all()
-        serialized_products = [
-            {
-                'category': product.category,
-                'model': product.model
-            }
-            for product in products
-        ]
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': 'An error occurred while fetching data.'}, status=500)
 
-        # Prepare response data
-        data = {
-            'customers': serialized_customers,
-            'guarantors': serialized_guarantors,
-            'productCategories': categories,
-            'products': serialized_products,
-        }
 
-        return JsonResponse({'success': True, 'data': data})
 
-    except Exception as e:
-        return JsonResponse({'success': False, 'message': 'An error occurred while fetching data.'}, status=500)
+@login_required
+async def SyncChanges(request):
+    """
+    Delta sync for offline clients: the user's customers, guarantors, accounts,
+    contracts and payments changed since a cursor, in batches (see app/sync.py). Query params:
+        cursor: `cursor` of the previous batch, none for a full sync
+        limit:  rows per batch (max SYNC_MAX_BATCH_SIZE)
+    """
+    user = await request.auser()
+
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'}, status=405)
+
+    try:
+        limit = min(int(request.GET.get('limit', SYNC_BATCH_SIZE)), SYNC_MAX_BATCH_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid batch size.'}, status=400)
+    if limit < 1:
+        return JsonResponse({'success': False, 'message': 'Invalid batch size.'}, status=400)
+
+    try:
+        batch = await sync_to_async(syncBatch)(user, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    return JsonResponse({'success': True, **batch})
 
 
 
 @login_required
-def CreateCustomer(request):
-    user = request.user
+async def CreateCustomer(request):
+    user = await request.auser()
 
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
@@ -197,8 +406,12 @@ def CreateCustomer(request):
         if not name or not phone or not address:
             return JsonResponse({'status': 'error', 'message': 'Full Name, Phone, and Address are required fields.'}, status=400)
 
+        phoneE164 = normalizePhone(phone)
+        if not phoneE164:
+            return JsonResponse({'status': 'error', 'message': 'Invalid phone number.'}, status=400)
+
         # Check if customer already exists with the given phone number
-        customer = Customer.objects.filter(phone=phone).first()
+        customer = await Customer.objects.filter(creator=user, phoneE164=phoneE164).afirst()
         if customer:
             response_data = {
                 'uid': customer.uid,
@@ -221,22 +434,18 @@ def CreateCustomer(request):
         guardian_name = data.get('guardianName')
 
         # Create new customer
-        customer = Customer.objects.create(
+        customer = await Customer.objects.acreate(
             creator=user,
             name=name,
             phone=phone,
             address=address,
+            age=int(age) if age else None,
             occupation=occupation,
             locationMark=location_mark,
             guardianType=guardian_type,
             guardianName=guardian_name
         )
 
-        # Set age if provided
-        if age:
-            customer.age = int(age)
-            customer.save()  # Save again to update age
-
         # Prepare response data
         response_data = {
             'uid': customer.uid,
@@ -268,8 +477,8 @@ def CreateCustomer(request):
 
 
 @login_required
-def CreateGuarantor(request):
-    user = request.user
+async def CreateGuarantor(request):
+    user = await request.auser()
 
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
@@ -288,8 +497,12 @@ def CreateGuarantor(request):
         if not name or not phone:
             return JsonResponse({'status': 'error', 'message': 'Name and Phone are required fields.'}, status=400)
 
+        phoneE164 = normalizePhone(phone)
+        if not phoneE164:
+            return JsonResponse({'status': 'error', 'message': 'Invalid phone number.'}, status=400)
+
         # Check if guarantor already exists with the given phone number
-        guarantor = Guarantor.objects.filter(phone=phone).first()
+        guarantor = await Guarantor.objects.filter(creator=user, phoneE164=phoneE164).afirst()
         if guarantor:
             response_data = {
                 'uid': guarantor.uid,
@@ -305,7 +518,7 @@ def CreateGuarantor(request):
             }, status=200)
 
         # Create new guarantor
-        guarantor = Guarantor.objects.create(
+        guarantor = await Guarantor.objects.acreate(
             creator=user,
             name=name,
             phone=phone,
@@ -337,8 +550,8 @@ def CreateGuarantor(request):
 
 
 @login_required
-def CreateAccount(request):
-    user = request.user
+async def CreateAccount(request):
+    user = await request.auser()
 
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
@@ -360,39 +573,39 @@ def CreateAccount(request):
         second_guarantor_uid = data['secondGuarantorUid']
 
         # Check if account already exists
-        if Account.objects.filter(accountNumber=account_number.upper()).exists():
+        if await Account.objects.filter(accountNumber=account_number.upper()).aexists():
             return JsonResponse({'status': 'error', 'message': f'An account already exists with this "{account_number}" account number.'}, status=400)
 
         # Check for customer
-        customer = Customer.objects.filter(uid=customer_uid).first()
+        customer = await Customer.objects.filter(uid=customer_uid).afirst()
         if not customer:
             return JsonResponse({'status': 'error', 'message': f'Customer with UID {customer_uid} does not exist.'}, status=404)
 
         # Check for product
-        product = Product.objects.filter(model=selected_model).first()
+        product = await Product.objects.filter(model=selected_model).afirst()
         if not product:
             return JsonResponse({'status': 'error', 'message': 'There is no product associated with the selected model.'}, status=400)
 
         # Check for guarantors
-        first_guarantor = Guarantor.objects.filter(uid=first_guarantor_uid).first()
-        second_guarantor = Guarantor.objects.filter(uid=second_guarantor_uid).first()
+        first_guarantor = await Guarantor.objects.filter(uid=first_guarantor_uid).afirst()
+        second_guarantor = await Guarantor.objects.filter(uid=second_guarantor_uid).afirst()
 
         if not first_guarantor or not second_guarantor:
             return JsonResponse({'status': 'error', 'message': f'Guarantors with UID {first_guarantor_uid} or {second_guarantor_uid} do not exist.'}, status=404)
 
         # Create account
-        account = Account.objects.create(
+        account = await Account.objects.acreate(
             creator=user,
             accountNumber=account_number,
             saleDate=data['saleDate'],
             customer=customer,
             product=product
         )
-        account.guarantors.add(first_guarantor, second_guarantor)
+        await account.guarantors.aadd(first_guarantor, second_guarantor)
 
         # Create contract
         try:
-            contract = Contract.objects.create(
+            contract = await Contract.objects.acreate(
                 uid=account.accountNumber,
                 cashValue=int(data['cashValue']),
                 hireValue=int(data['hireValue']),
@@ -401,7 +614,7 @@ def CreateAccount(request):
                 length=int(data['length'])
             )
             account.contract = contract
-            account.save()
+            await account.asave()
         except Exception as e:
             return JsonResponse({'status': 'success', 'message': 'Account created successfully, but there might be issues with the contract information.'})
 
@@ -419,12 +632,12 @@ def CreateAccount(request):
 
 
 @login_required
-def CreatePayment(request, pk):
+async def CreatePayment(request, pk):
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
     
-    account = Account.objects.filter(pk=pk).first()
-    contract = account.contract
+    account = await Account.objects.select_related('contract').filter(pk=pk).afirst()
+    contract = account.contract if account else None
     if not contract:
         return JsonResponse({'status': 'error', 'message': 'The account you\'re trying to make payment is invalid!'})
     
@@ -448,10 +661,10 @@ def CreatePayment(request, pk):
         if paymentAmount > contract.hireBalance:
             return JsonResponse({'status': 'error', 'message': 'Payment amount exceeds hire balance.'})
         
-        if Payment.objects.filter(receiptId=receiptNumber).exists():
+        if await Payment.objects.filter(receiptId=receiptNumber).aexists():
             return JsonResponse({'status': 'error', 'message': f'"{receiptNumber}" this receipt ID already exists.'})
 
-        payment = Payment.objects.create(
+        payment = await Payment.objects.acreate(
             contract=contract,
             date=paymentDate,
             receiptId=receiptNumber,
@@ -466,6 +679,8 @@ def CreatePayment(request, pk):
         }
         return JsonResponse({'status': 'success', 'message': 'Payment created!', 'data': data})
 
+    except ValidationError as e:
+        return JsonResponse({'status': 'error', 'message': ' '.join(e.messages)}, status=400)
     except json.JSONDecodeError:
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON data.'}, status=400)
     except Exception as e:
@@ -475,6 +690,8 @@ def CreatePayment(request, pk):
 
 
 @login_required
+@replicaView
+@conditionalOn(lambda request: [PRODUCTS_VERSION_KEY])
 def productList(request):
     categories = [cat[0] for cat in PRODUCT_CATEGORIES]
     products = Product.objects.all()
@@ -486,7 +703,7 @@ def productList(request):
     return render(request, 'pages/productList.html', context)
 
 @login_required
-def createProduct(request):
+async def createProduct(request):
     if request.method != 'POST':
         return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
     
@@ -504,10 +721,10 @@ def createProduct(request):
         if not category or not model:
             return JsonResponse({'status': 'error', 'message': 'Product category or model can\'t be empty'})
         
-        if Product.objects.filter(model=model).exists():
+        if await Product.objects.filter(model=model).aexists():
             return JsonResponse({'status': 'error', 'message': f'A product with this ({model}) model already exists!'})
 
-        Product.objects.create(category=category, model=model)
+        await Product.objects.acreate(category=category, model=model)
         
         data = {
             'category': category,
@@ -520,3 +737,104 @@ def createProduct(request):
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': f'{e}'}, status=500)
 
+
+
+
+@login_required
+def ImportPayments(request):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+    upload = request.FILES.get('file')
+    if not upload:
+        return JsonResponse({'status': 'error', 'message': '"file" is required.'}, status=400)
+
+    fmt = request.POST.get('format') or detectFormat(upload.name)
+    if fmt not in ('csv', 'jsonl'):
+        return JsonResponse({'status': 'error', 'message': f'Unsupported file format: {fmt}'}, status=400)
+
+    try:
+        report = importPayments(readRows(upload.file, fmt), creator=request.user)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': f'{e}'}, status=500)
+
+    return JsonResponse({
+        'status': 'success',
+        'message': f'Imported {report.created} of {report.processed} payments.',
+        'data': report.asDict()
+    })
+
+
+
+@login_required
+async def CreatePayments(request):
+    """
+    Post a whole collection route in one request. Body: {"payments": [{account, receiptId,
+    date, amount}, ...]}. Every item gets a result (see importers.postPayments), so an
+    upload retried over a flaky connection reports its already posted payments as duplicates.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data.'}, status=400)
+
+    items = data.get('payments') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'status': 'error', 'message': '"payments" must be a non-empty list.'}, status=400)
+    if len(items) > MAX_POSTED_PAYMENTS:
+        return JsonResponse({'status': 'error', 'message': f'At most {MAX_POSTED_PAYMENTS} payments per request.'}, status=400)
+
+    user = await request.auser()
+    try:
+        results = await sync_to_async(postPayments)(items, user)
+    except IntegrityError:
+        return JsonResponse({'status': 'error', 'message': 'A receipt was posted meanwhile, please retry.'}, status=409)
+
+    created = sum(result['status'] == 'created' for result in results)
+    return JsonResponse({
+        'status': 'success',
+        'message': f'Posted {created} of {len(results)} payments.',
+        'data': {'created': created, 'results': results}
+    })
+
+
+
+@login_required
+@replicaView
+def ExportLedger(request):
+    try:
+        date_from = parseDate(request.GET.get('from'))
+        date_to = parseDate(request.GET.get('to'))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+
+    rows = ledgerRows(request.user, date_from, date_to)
+    filename = f'ledger-{request.user.username}'
+
+    if request.GET.get('format') == 'xlsx':
+        # XLSX can't be streamed while written, build it in a temporary file in write-only mode
+        file = tempfile.TemporaryFile(suffix='.xlsx')
+        try:
+            writeXlsx(rows, file)
+        except ImportError as e:
+            file.close()
+            return JsonResponse({'status': 'error', 'message': f'{e}'}, status=400)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename=f'{filename}.xlsx')
+
+    response = StreamingHttpResponse(csvLines(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+
+
+def Metrics(request):
+    """ Prometheus scrape target, summed over all workers (see app/metrics.py). """
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
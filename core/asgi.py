@@ -3,6 +3,15 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The JSON API views are async: under ASGI a worker keeps serving other requests
+while they wait on the database, and image work runs on app.utils.imageExecutor.
+Run it with uvicorn workers instead of the default sync ones:
+
+    gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker --workers 2 --bind 0.0.0.0:8000
+
+or `uvicorn core.asgi:application --host 0.0.0.0 --port 8000 --workers 2`. Keep
+CONN_MAX_AGE at 0 (the default): under ASGI connections belong to per-request threads.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -31,10 +31,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'app.metrics.MetricsMiddleware',
+    'app.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -43,7 +46,7 @@ ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'app.profiling.ProfilingTemplates',  # DjangoTemplates, with render time in the profile
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -63,6 +66,45 @@ DATABASES = {
     'default': env.db('DATABASE_URL')
 }
 
+# Optional read replica for the list, report and export views and the reporting commands
+# (app/routers.py). A user's reads stay on the primary for REPLICA_PIN_SECONDS after they
+# write. To try it locally, copy db.sqlite3 and point REPLICA_DATABASE_URL at the copy.
+if env('REPLICA_DATABASE_URL', default=None):
+    DATABASES['replica'] = env.db('REPLICA_DATABASE_URL')
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=15)
+
+# Trigram lookups for the account search (see app/search.py)
+if DATABASES['default']['ENGINE'].startswith('django.db.backends.postgresql'):
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+# Share of requests profiled by app.profiling.ProfilingMiddleware (Server-Timing header),
+# and the time above which a request is logged as slow, with its slowest SQL when profiled
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', default=0.1)
+SLOW_REQUEST_MS = env.int('SLOW_REQUEST_MS', default=1000)
+PROFILING_TOP_SQL = 5
+
+# /metrics (app/metrics.py): every worker writes its metrics to a file in METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds, from a background thread; the directory is
+# emptied when the server starts. With METRICS_TOKEN set, scrapes need "Authorization: Bearer <token>".
+METRICS_DIR = env('METRICS_DIR', default=str(BASE_DIR / '.metrics'))
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=1.0)
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+
+# Delta sync (app/sync.py): rows changed this many seconds before a client's cursor are sent
+# again (transactions committing late), and deletes are remembered this many days
+SYNC_OVERLAP_SECONDS = env.int('SYNC_OVERLAP_SECONDS', default=60)
+SYNC_TOMBSTONE_DAYS = env.int('SYNC_TOMBSTONE_DAYS', default=90)
+
+# Must be shared by all workers (file, redis or memcached URL); locmemcache:// only suits a single process
+CACHES = {
+    'default': env.cache('CACHE_URL', default=f'filecache://{BASE_DIR / ".cache"}'),
+}
+
+# Tests use a local memory cache and temporary media and metrics directories
+TEST_RUNNER = 'app.testrunner.TestRunner'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
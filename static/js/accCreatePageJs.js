@@ -62,18 +62,61 @@ let appData = {
 
 let currentGuarantorType = null; // Tracks whether creating first or second guarantor
 
+// Last payload from the backend, kept so later visits only download what changed
+const PRECREATION_CACHE_KEY = 'precreationData';
+
+function loadCachedData() {
+    try {
+        return JSON.parse(localStorage.getItem(PRECREATION_CACHE_KEY));
+    } catch (error) {
+        return null;
+    }
+}
+
+// Rows of a delta replace the cached ones with the same uid; newest (highest uid) first like the full payload
+function mergeByUid(items, changed) {
+    const merged = new Map(items.map(item => [item.uid, item]));
+    changed.forEach(item => merged.set(item.uid, item));
+    return [...merged.values()].sort((a, b) => b.uid - a.uid);
+}
+
 // Fetch initial data from Django backend
 async function fetchInitialData() {
     try {
-        const response = await fetch('/account-precreation/data/');
+        let cached = loadCachedData();
+        let url = '/account-precreation/data/';
+        if (cached && cached.version && cached.data) {
+            const params = new URLSearchParams({ version: cached.version });
+            url += `?${params}`;
+        }
+
+        const response = await fetch(url);
         const result = await response.json();
 
         if (result.success) {
+            let data = result.data;
+            if (result.unchanged) {
+                data = cached.data;
+            } else if (result.delta) {
+                data = {
+                    ...cached.data,
+                    customers: mergeByUid(cached.data.customers, result.data.customers),
+                    guarantors: mergeByUid(cached.data.guarantors, result.data.guarantors),
+                    products: result.data.products || cached.data.products,
+                };
+            }
+
+            try {
+                localStorage.setItem(PRECREATION_CACHE_KEY, JSON.stringify({ version: result.version, data }));
+            } catch (error) {
+                localStorage.removeItem(PRECREATION_CACHE_KEY); // Storage full or disabled
+            }
+
             appData = {
-                customers: result.data.customers || [],
-                guarantors: result.data.guarantors || [],
-                productCategories: result.data.productCategories || [],
-                products: result.data.products || []
+                customers: [...(data.customers || [])],
+                guarantors: [...(data.guarantors || [])],
+                productCategories: data.productCategories || [],
+                products: data.products || []
             };
 
             // Populate product categories dropdown
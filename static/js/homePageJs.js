@@ -1,9 +1,16 @@
-let AccountData = [];
+const PAGE_SIZE = 50;
+const SEARCH_DELAY = 300; // ms to wait after typing before querying the server
+
+let nextCursor = null;
+let isLoading = false;
+let requestId = 0; // Ignores responses of outdated searches
+let searchTimer = null;
 
 // DOM References
 const DOM = {
     query: document.getElementById('searchField'), // Input field
     filterBy: document.getElementById('filterField'), // Dropdown select
+    status: document.getElementById('statusField'), // Active/Closed select
     dataList: document.getElementById('dataList'), // Data container
     loadingState: document.getElementById('loadingState'),
     emptyState: document.getElementById('emptyState'),
@@ -11,12 +18,12 @@ const DOM = {
 };
 
 // Render Data Function
-const renderData = (data) => {
-    DOM.dataList.innerHTML = data.map((item, index) => `
+const renderData = (data, append) => {
+    const html = data.map((item, index) => `
         <a href="/account/get/${item.pk}/" class="data-item grid grid-cols-3 md:grid-cols-6 gap-4 items-center px-6 py-2 hover:bg-gray-700/20 transition-all" 
-           style="animation-delay: ${index * 50}ms">
+           style="animation-delay: ${append ? 0 : index * 50}ms">
             <div class="col-span-2 flex items-center gap-4">
-                <img src="${item.avatar}" class="w-10 h-10 rounded-full">
+                <img src="${item.avatar}" class="w-10 h-10 rounded-full" loading="lazy">
                 <div>
                     <h3 class="font-medium">${item.name}</h3>
                     <span class="text-xs ${item.isActive === true ? 'text-green-400' : 'text-gray-400'}">
@@ -32,67 +39,105 @@ const renderData = (data) => {
         </a>
     `).join('');
 
-    DOM.emptyState.classList.toggle('hidden', data.length > 0);
-    DOM.dataList.classList.toggle('hidden', data.length === 0);
+    if (append) {
+        DOM.dataList.insertAdjacentHTML('beforeend', html);
+    } else {
+        DOM.dataList.innerHTML = html;
+    }
+
+    const isEmpty = DOM.dataList.children.length === 0;
+    DOM.emptyState.classList.toggle('hidden', !isEmpty);
+    DOM.dataList.classList.toggle('hidden', isEmpty);
 };
 
-// Filter Data Function
-const filterData = () => {
-    const queryText = DOM.query.value.toLowerCase();
-    const filterBy = DOM.filterBy.value;
+// Fetch one page from the server, starting after the current cursor when appending
+const loadPage = async (append = false) => {
+    if (isLoading && append) return;
+    if (append && !nextCursor) return;
 
-    const filtered = AccountData.filter(item => 
-        String(item[filterBy]).toLowerCase().includes(queryText)
-    );
+    const currentRequest = ++requestId;
+    isLoading = true;
 
-    renderData(filtered);
-};
+    const params = new URLSearchParams({
+        limit: PAGE_SIZE,
+        status: DOM.status.value,
+        by: DOM.filterBy.value,
+        q: DOM.query.value.trim()
+    });
+    if (append) params.set('cursor', nextCursor);
+
+    // Smart search ranks the best fuzzy matches, one page only
+    const smartSearch = DOM.filterBy.value === 'smart' && params.get('q');
+    const url = smartSearch ? `/accounts/search/?${params}` : `/accounts/get/?${params}`;
 
-// Initialize Data Function
-const init = async () => {
     try {
-        DOM.loadingState.classList.remove('hidden');
+        if (!append) DOM.loadingState.classList.remove('hidden');
         DOM.errorState.classList.add('hidden');
-        DOM.dataList.classList.add('hidden');
-
-        // Simulated API call with dummy data
-        // await new Promise(resolve => setTimeout(resolve, 200));
-        // AccountData = [
-        //     {
-        //         name: "John Doe",
-        //         phone: "+880 1712-000000",
-        //         account: "ID-123456",
-        //         balance: 5000,
-        //         avatar: "https://via.placeholder.com/40",
-        //         isActive: true
-        //     },
-        // ];
-
-        // Fetch data from the backend
-        const response = await fetch('/accounts/get/');
+
+        const response = await fetch(url);
         if (!response.ok) throw new Error('Server response error');
         const data = await response.json();
-        
+        if (currentRequest !== requestId) return;
 
         if (data.success) {
-            AccountData = data.accounts;
-            renderData(AccountData);
+            nextCursor = data.nextCursor || null;
+            renderData(data.accounts, append);
         } else {
             DOM.emptyState.classList.remove('hidden');
         }
 
     } catch (err) {
-        console.error('Data initialization error:', err);
+        console.error('Data load error:', err);
         DOM.errorState.classList.remove('hidden');
     } finally {
-        DOM.loadingState.classList.add('hidden');
+        if (currentRequest === requestId) {
+            isLoading = false;
+            DOM.loadingState.classList.add('hidden');
+        }
+    }
+};
+
+// Restart from the first page whenever the search changes
+const filterData = () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => {
+        nextCursor = null;
+        loadPage(false);
+    }, SEARCH_DELAY);
+};
+
+// Load the next page when the list is scrolled near its bottom
+const onScroll = () => {
+    const { scrollTop, scrollHeight, clientHeight } = DOM.dataList;
+    if (scrollHeight - scrollTop - clientHeight < 200) {
+        loadPage(true);
+    }
+};
+
+// Dashboard totals, a failure only hides the cards
+const loadStats = async () => {
+    try {
+        const response = await fetch('/dashboard/stats/');
+        if (!response.ok) return;
+        const data = await response.json();
+        if (!data.success) return;
+
+        document.querySelectorAll('[data-stat]').forEach(element => {
+            element.textContent = data.stats[element.dataset.stat].toLocaleString();
+        });
+        document.getElementById('statsContainer').classList.remove('hidden');
+    } catch (err) {
+        console.error('Stats load error:', err);
     }
 };
 
 // Event Listeners
 DOM.query.addEventListener('input', filterData);
 DOM.filterBy.addEventListener('change', filterData);
+DOM.status.addEventListener('change', filterData);
+DOM.dataList.addEventListener('scroll', onScroll);
 
 // Start Application
 DOM.query.focus();
-init();
\ No newline at end of file
+loadPage(false);
+loadStats();